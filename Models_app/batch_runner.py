@@ -0,0 +1,121 @@
+"""
+Offline bulk processing of archived pedigree scans.
+
+Reads a JSONL manifest with one {"id": ..., "path": ...} object per line, runs every image
+through `process_image` on a process pool (each worker loads PedigreeDetector once) and
+appends one JSON line per image to the output file as soon as it finishes. Ids already
+recorded as "ok" in the output are skipped, so a crashed run is resumed by re-running
+the same command.
+
+Usage:
+    python -m Models_app.batch_runner manifest.jsonl results.jsonl --workers 4
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+_process_image = None
+
+def init_worker(threads_per_worker):
+    """Load the detector once per worker process and keep the workers from oversubscribing cores."""
+    global _process_image
+    os.environ.setdefault("OMP_NUM_THREADS", str(threads_per_worker))
+    import torch
+    torch.set_num_threads(threads_per_worker)
+    from .services.image_processor import process_image, get_detector
+    get_detector()
+    _process_image = process_image
+
+def run_one(image_id, path):
+    started = time.perf_counter()
+    try:
+        result = _process_image(path, image_id=image_id, raise_errors=True)
+        record = {"id": image_id, "path": path, "status": "ok", "result": result}
+    except Exception as e:
+        record = {"id": image_id, "path": path, "status": "error", "error": f"{type(e).__name__}: {e}"}
+    record["seconds"] = round(time.perf_counter() - started, 3)
+    return record
+
+def completed_ids(output_path):
+    """Ids already processed successfully; a torn last line from a crash is ignored."""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, "r") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record.get("status") == "ok":
+                done.add(str(record["id"]))
+    return done
+
+def read_manifest(manifest_path, skip_ids):
+    with open(manifest_path, "r") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            path = entry.get("path") or entry.get("image_path")
+            if not path:
+                raise ValueError(f"{manifest_path}:{line_number}: missing 'path'")
+            image_id = str(entry.get("id", entry.get("image_id", path)))
+            if image_id not in skip_ids:
+                yield image_id, path
+
+def run(manifest_path, output_path, workers, report_every=10):
+    skip_ids = completed_ids(output_path)
+    if skip_ids:
+        print(f"Resuming: {len(skip_ids)} images already done")
+    threads_per_worker = max(1, (os.cpu_count() or 1) // workers)
+    context = multiprocessing.get_context("spawn")  # torch does not survive fork once initialised
+    processed = failed = 0
+    started = time.perf_counter()
+    entries = read_manifest(manifest_path, skip_ids)
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_worker, initargs=(threads_per_worker,)) as executor, \
+            open(output_path, "a") as output:
+        pending = set()
+        exhausted = False
+        while pending or not exhausted:
+            # keep a bounded number of images in flight instead of submitting the whole manifest
+            while not exhausted and len(pending) < 2 * workers:
+                entry = next(entries, None)
+                if entry is None:
+                    exhausted = True
+                else:
+                    pending.add(executor.submit(run_one, *entry))
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                record = future.result()
+                output.write(json.dumps(record) + "\n")
+                output.flush()
+                processed += 1
+                failed += record["status"] != "ok"
+                if processed % report_every == 0:
+                    elapsed = time.perf_counter() - started
+                    print(f"{processed} images in {elapsed:.1f}s ({processed / elapsed:.2f} images/s), {failed} failed")
+
+    elapsed = time.perf_counter() - started
+    rate = processed / elapsed if elapsed else 0.0
+    print(f"Done: {processed} images in {elapsed:.1f}s ({rate:.2f} images/s), {failed} failed")
+    return {"processed": processed, "failed": failed, "seconds": elapsed, "images_per_second": rate}
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the pedigree pipeline over a JSONL manifest of images.")
+    parser.add_argument("manifest", help="JSONL file with one {\"id\": ..., \"path\": ...} per line")
+    parser.add_argument("output", help="JSONL file results are appended to")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument("--report-every", type=int, default=10, help="print throughput every N images")
+    args = parser.parse_args()
+    run(args.manifest, args.output, args.workers, args.report_every)
+
+if __name__ == "__main__":
+    main()
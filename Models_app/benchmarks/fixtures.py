@@ -0,0 +1,35 @@
+"""
+Tiny local detector weights, so benchmarks run without the production checkpoints.
+
+The weights are a randomly initialised YOLO11n built from its yaml (no download). Accuracy
+is meaningless but the forward pass has the right shape and cost for latency work.
+"""
+import os
+
+DEFAULT_ARCHITECTURE = "yolo11n.yaml"
+
+def make_tiny_weights(out_dir, architecture=DEFAULT_ARCHITECTURE):
+    """
+    Build (once) and return the path of tiny random weights in `out_dir`.
+
+    Args:
+        out_dir (str): Directory the checkpoint is cached in.
+        architecture (str): Ultralytics model yaml to build.
+
+    Returns:
+        str: Path of the saved .pt file.
+    """
+    path = os.path.join(out_dir, os.path.splitext(architecture)[0] + "-random.pt")
+    if not os.path.exists(path):
+        from ultralytics import YOLO
+        os.makedirs(out_dir, exist_ok=True)
+        YOLO(architecture).save(path)
+    return path
+
+def use_tiny_weights(out_dir):
+    """Point NODES_MODEL_PATH / TEXT_MODEL_PATH at tiny weights unless they are already set."""
+    if os.getenv("NODES_MODEL_PATH") and os.getenv("TEXT_MODEL_PATH"):
+        return
+    path = make_tiny_weights(out_dir)
+    os.environ.setdefault("NODES_MODEL_PATH", path)
+    os.environ.setdefault("TEXT_MODEL_PATH", path)
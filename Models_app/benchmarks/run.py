@@ -0,0 +1,192 @@
+"""
+End-to-end and per-stage benchmarks on synthetic pedigree charts.
+
+Scenarios:
+    single  - `process_image` latency, one image at a time
+    http    - concurrent POSTs to /image-info/ (in-process app, or --url of a running server)
+    stages  - `detect`, `group_and_merge_labels` and `encode_image` in isolation
+
+Unless --vlm-url is given, an in-process stub VLM (see stub_vlm.py) answers OCR calls, and
+unless NODES_MODEL_PATH / TEXT_MODEL_PATH are set, tiny random weights are used (see
+fixtures.py). Each run writes a JSON report with p50/p95/p99 per metric.
+
+Usage:
+    python -m Models_app.benchmarks.run stages --nodes 12 --size 1600x1200 --iterations 50
+    python -m Models_app.benchmarks.run http --concurrency 8 --requests 200 --output http.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import time
+import numpy as np
+from .synthetic import generate_chart, encode_chart
+
+def summarize(samples):
+    """Latency summary in milliseconds for a list of durations in seconds."""
+    if not samples:
+        return {"count": 0}
+    values = np.asarray(samples) * 1000
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        "count": len(values),
+        "mean_ms": round(float(values.mean()), 3),
+        "min_ms": round(float(values.min()), 3),
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+        "max_ms": round(float(values.max()), 3),
+    }
+
+def timed(samples, func, *args, **kwargs):
+    started = time.perf_counter()
+    result = func(*args, **kwargs)
+    samples.append(time.perf_counter() - started)
+    return result
+
+def charts(args, count=None):
+    """
+    Yield (seed, image, nodes, text) for `count` charts (default: warmup + iterations), with a
+    distinct seed per chart so the result cache never hits.
+    """
+    for i in range(args.warmup + args.iterations if count is None else count):
+        yield (i, *generate_chart(args.nodes, args.width, args.height, seed=args.seed + i))
+
+def bench_stages(args):
+    from ..processors.text_processor import TextProcessor, encode_image
+    from ..services.image_processor import detect
+    from ..services.pedigree_tree import PedigreeTree
+    from ..services.detection_table import DetectionTable
+
+    samples = {"detect": [], "group_and_merge_labels": [], "encode_image": []}
+    for i, image, nodes, text in charts(args):
+        record = i >= args.warmup
+        scratch = {name: [] for name in samples}
+        if not args.skip_detect:
+            timed(scratch["detect"], detect, image)
+        # ground truth stands in for detections
+        tree = PedigreeTree(nodes=DetectionTable.from_predictions(nodes), text=DetectionTable.from_predictions(text), image=image, image_id=i)
+        merged = timed(scratch["group_and_merge_labels"], TextProcessor(tree).group_and_merge_labels)
+        for _, crop in merged:
+            timed(scratch["encode_image"], encode_image, crop)
+        if record:
+            for name, values in scratch.items():
+                samples[name].extend(values)
+    return {name: summarize(values) for name, values in samples.items()}, None
+
+def bench_single(args):
+    from ..services.image_processor import process_image
+
+    samples = []
+    for i, image, _, _ in charts(args):
+        started = time.perf_counter()
+        process_image(image, image_id=f"bench-{i}", raise_errors=True)
+        if i >= args.warmup:
+            samples.append(time.perf_counter() - started)
+    return {"process_image": summarize(samples)}, len(samples) / sum(samples)
+
+async def bench_http_async(args):
+    import httpx
+
+    # one distinct chart per request, so the measured latency is never a result cache hit
+    payloads = [encode_chart(image) for _, image, _, _ in charts(args, args.warmup + args.requests)]
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=args.timeout)
+    else:
+        from ..main import app
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=args.timeout)
+
+    samples, errors = [], 0
+    async def post(payload):
+        nonlocal errors
+        started = time.perf_counter()
+        response = await client.post("/image-info/", files={"file": ("chart.png", payload, "image/png")}, data={"apply_orientation_correction": "false"})
+        if response.status_code != 200:
+            errors += 1
+        return time.perf_counter() - started
+
+    async with client:
+        for payload in payloads[:args.warmup]:
+            await post(payload)
+        queue = asyncio.Queue()
+        for i in range(args.requests):
+            queue.put_nowait(payloads[args.warmup + i])
+        async def worker():
+            while not queue.empty():
+                samples.append(await post(queue.get_nowait()))
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+        # OCR cache hits are expected (labels repeat across charts); reported so runs can be compared
+        cache = (await client.get("/cache-stats")).json()
+    metrics = {"request": summarize(samples), "errors": errors, "cache": cache}
+    return metrics, len(samples) / elapsed
+
+def bench_http(args):
+    return asyncio.run(bench_http_async(args))
+
+SCENARIOS = {"single": bench_single, "http": bench_http, "stages": bench_stages}
+
+def configure(args):
+    """Point the app at the stub VLM and tiny weights before any service module is imported."""
+    stub = None
+    if args.vlm_url:
+        os.environ["VLLM_SERVER_URL"] = args.vlm_url
+    elif args.scenario != "stages" and not (args.url and args.scenario == "http"):
+        from .stub_vlm import StubVLMServer
+        stub = StubVLMServer(("127.0.0.1", 0), args.vlm_latency_ms, args.vlm_jitter_ms).start()
+        os.environ["VLLM_SERVER_URL"] = stub.url
+    os.environ.setdefault("VLLM_MODEL_ID", "stub")
+    needs_models = args.scenario == "single" or (args.scenario == "stages" and not args.skip_detect) or (args.scenario == "http" and not args.url)
+    if needs_models:
+        from .fixtures import use_tiny_weights
+        use_tiny_weights(args.weights_dir)
+    return stub
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the pedigree pipeline on synthetic charts.")
+    parser.add_argument("scenario", choices=sorted(SCENARIOS))
+    parser.add_argument("--nodes", type=int, default=12, help="individuals per chart")
+    parser.add_argument("--size", default="1600x1200", help="chart resolution, WIDTHxHEIGHT")
+    parser.add_argument("--iterations", type=int, default=20, help="distinct charts measured")
+    parser.add_argument("--warmup", type=int, default=2, help="charts processed before measuring")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--concurrency", type=int, default=4, help="http: parallel clients")
+    parser.add_argument("--requests", type=int, default=50, help="http: total measured requests, one distinct chart each")
+    parser.add_argument("--timeout", type=float, default=120.0, help="http: per-request timeout")
+    parser.add_argument("--url", help="http: base URL of a running server instead of the in-process app")
+    parser.add_argument("--vlm-url", help="use this OpenAI-compatible server instead of the stub")
+    parser.add_argument("--vlm-latency-ms", type=float, default=300.0)
+    parser.add_argument("--vlm-jitter-ms", type=float, default=50.0)
+    parser.add_argument("--skip-detect", action="store_true", help="stages: skip the detector (no weights needed)")
+    parser.add_argument("--weights-dir", default=os.path.join(".benchmarks", "weights"))
+    parser.add_argument("--output", help="write the JSON report here (default: stdout only)")
+    args = parser.parse_args(argv)
+    args.width, args.height = map(int, args.size.lower().split("x"))
+
+    stub = configure(args)
+    try:
+        metrics, throughput = SCENARIOS[args.scenario](args)
+    finally:
+        if stub:
+            stub.shutdown()
+
+    report = {
+        "scenario": args.scenario,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output",)},
+        "environment": {"python": sys.version.split()[0], "platform": platform.platform(), "cpus": os.cpu_count()},
+        "metrics": metrics,
+    }
+    if throughput is not None:
+        report["throughput_per_second"] = round(throughput, 3)
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+if __name__ == "__main__":
+    main()
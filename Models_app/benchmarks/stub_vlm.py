@@ -0,0 +1,120 @@
+"""
+Local OpenAI-compatible stand-in for the vLLM server.
+
+Answers /v1/chat/completions with a well-formed label JSON after a configurable delay, so the
+pipeline can be benchmarked without a GPU. Multi-image requests get one array entry per
+"Node id N:" marker, matching `build_batch_messages`.
+
+Usage:
+    python -m Models_app.benchmarks.stub_vlm --port 8001 --latency-ms 300 --jitter-ms 100
+    VLLM_SERVER_URL=http://127.0.0.1:8001/v1 VLLM_MODEL_ID=stub ...
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+NODE_ID_PATTERN = re.compile(r"Node id (\d+):")
+
+def fake_label(rng, structured=False):
+    if structured:  # the LabelData schema sent as response_format
+        return {"name": f"Person {rng.randint(1, 999)}", "age": str(rng.randint(1, 99)), "dob": "", "diseases": []}
+    return {"Name": f"Person {rng.randint(1, 999)}", "Age": str(rng.randint(1, 99)), "Date of Birth": "", "Disease": "[]"}
+
+def completion(body, rng):
+    content = body.get("messages", [{}])[-1].get("content", [])
+    parts = content if isinstance(content, list) else [{"type": "text", "text": content}]
+    node_ids = [int(match) for part in parts if part.get("type") == "text" for match in NODE_ID_PATTERN.findall(part.get("text", ""))]
+    structured = body.get("response_format") is not None
+    if node_ids:
+        text = json.dumps([{"id": node_id, **fake_label(rng, structured)} for node_id in node_ids])
+    else:
+        text = json.dumps(fake_label(rng, structured))
+    return {
+        "id": f"stub-{rng.getrandbits(32):08x}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "stub"),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+    }
+
+class StubVLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency_ms=300.0, jitter_ms=0.0, error_rate=0.0, seed=0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+        self.requests = 0
+        super().__init__(address, StubVLMHandler)
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        """Serve on a daemon thread (for in-process benchmarks) and return self."""
+        threading.Thread(target=self.serve_forever, name="stub-vlm", daemon=True).start()
+        return self
+
+class StubVLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def send_json(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self.send_json(200, {"object": "list", "data": [{"id": "stub", "object": "model"}]})
+        else:
+            self.send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_json(404, {"error": {"message": "not found"}})
+            return
+        server = self.server
+        with server.rng_lock:
+            server.requests += 1
+            delay = max(0.0, server.latency_ms + server.rng.uniform(-server.jitter_ms, server.jitter_ms)) / 1000
+            failed = server.rng.random() < server.error_rate
+            response = completion(body, server.rng)
+        time.sleep(delay)
+        if failed:
+            self.send_json(503, {"error": {"message": "stub overloaded"}})
+        else:
+            self.send_json(200, response)
+
+    def log_message(self, format, *args):
+        pass
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI-compatible stub VLM server for benchmarks.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency-ms", type=float, default=300.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    server = StubVLMServer((args.host, args.port), args.latency_ms, args.jitter_ms, args.error_rate)
+    print(f"Stub VLM listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Synthetic pedigree charts for benchmarking.
+
+Draws a grid of generations with squares (male) and circles (female), partner and descent
+lines and one or two text labels under each node, and returns the image together with the
+ground-truth node and text boxes in the same prediction format the detectors produce.
+"""
+import random
+import cv2
+import numpy as np
+
+FIRST_NAMES = ["John", "Mary", "Ahmed", "Sara", "Li", "Anna", "Omar", "Eva", "Ravi", "Nora"]
+DISEASES = ["DM", "HTN", "Ca breast", "Asthma", "CF"]
+
+def box_to_prediction(box, class_name, class_id):
+    x1, y1, x2, y2 = box
+    return {
+        "x": (x1 + x2) / 2,
+        "y": (y1 + y2) / 2,
+        "width": float(x2 - x1),
+        "height": float(y2 - y1),
+        "confidence": 1.0,
+        "class": class_name,
+        "class_id": class_id,
+    }
+
+def generate_chart(num_nodes=12, width=1600, height=1200, seed=0):
+    """
+    Draw a synthetic pedigree chart.
+
+    Args:
+        num_nodes (int): Number of individuals to draw.
+        width (int): Image width in pixels.
+        height (int): Image height in pixels.
+        seed (int): Seed for names, sexes and label content, so runs are reproducible.
+
+    Returns:
+        tuple: (grayscale np.ndarray, nodes dict, text dict), the dicts in `detections_to_predictions` format.
+    """
+    rng = random.Random(seed)
+    image = np.full((height, width), 255, dtype=np.uint8)
+    generations = max(1, int(np.ceil(np.sqrt(num_nodes / 2))))
+    per_row = int(np.ceil(num_nodes / generations))
+    cell_w, cell_h = width / per_row, height / generations
+    size = int(max(12, min(cell_w, cell_h) * 0.3))
+    font_scale = max(0.3, size / 60)
+
+    node_predictions, text_predictions = [], []
+    for index in range(num_nodes):
+        row, col = divmod(index, per_row)
+        cx, cy = int((col + 0.5) * cell_w), int(row * cell_h + cell_h * 0.35)
+        box = (cx - size // 2, cy - size // 2, cx + size // 2, cy + size // 2)
+        male = rng.random() < 0.5
+        affected = rng.random() < 0.3
+        if male:
+            cv2.rectangle(image, box[:2], box[2:], 0, -1 if affected else 2)
+        else:
+            cv2.circle(image, (cx, cy), size // 2, 0, -1 if affected else 2)
+        node_predictions.append(box_to_prediction(box, "Male" if male else "Female", 1 if male else 0))
+
+        if col > 0 and col % 2 == 1:  # partner line to the left neighbour
+            cv2.line(image, (int(cx - cell_w + size // 2), cy), (cx - size // 2, cy), 0, 2)
+        if row > 0:  # descent line up to the previous generation
+            cv2.line(image, (cx, box[1]), (cx, int(box[1] - cell_h * 0.3)), 0, 2)
+
+        labels = [f"{rng.choice(FIRST_NAMES)} {rng.randint(1930, 2020)}"]
+        if affected:
+            labels.append(rng.choice(DISEASES))
+        y = box[3] + int(size * 0.2)
+        for label in labels:
+            (text_w, text_h), baseline = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, font_scale, 1)
+            x = cx - text_w // 2
+            y += text_h + baseline
+            cv2.putText(image, label, (x, y), cv2.FONT_HERSHEY_SIMPLEX, font_scale, 0, 1)
+            text_box = (x, y - text_h - baseline // 2, x + text_w, y + baseline)
+            text_predictions.append(box_to_prediction(text_box, "Text", 0))
+
+    image_info = {"width": width, "height": height}
+    return image, {"predictions": node_predictions, "image": image_info}, {"predictions": text_predictions, "image": image_info}
+
+def encode_chart(image, ext=".png"):
+    """Encode a generated chart as upload bytes."""
+    ok, buffer = cv2.imencode(ext, image)
+    if not ok:
+        raise ValueError(f"Could not encode synthetic chart as {ext}")
+    return buffer.tobytes()
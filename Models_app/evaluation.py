@@ -0,0 +1,198 @@
+"""
+Detection regression harness: accuracy and speed of `PedigreeDetector.detection_pipeline`
+against YOLO-format ground truth.
+
+Images are matched to `<label dir>/<image stem>.txt` for each model. Ground truth is loaded
+in bulk across processes (sizes from file headers, vectorised label parsing), then every image
+is run through the detector in-process while its inference time is recorded. The report
+holds per-class precision/recall at IoU 0.5, AP50 and AP50-95, mAP per model and
+p50/p95/p99 inference latency.
+
+Usage:
+    python -m Models_app.evaluation data/images --nodes-labels data/nodes/labels \\
+        --text-labels data/text/labels --output eval.json
+"""
+import argparse
+import glob
+import json
+import os
+import time
+import numpy as np
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff")
+IOU_THRESHOLDS = np.linspace(0.5, 0.95, 10)
+
+def box_iou(boxesA: np.ndarray, boxesB: np.ndarray) -> np.ndarray:
+    """(len(A), len(B)) IoU matrix of xyxy boxes."""
+    xA = np.maximum(boxesA[:, None, 0], boxesB[None, :, 0])
+    yA = np.maximum(boxesA[:, None, 1], boxesB[None, :, 1])
+    xB = np.minimum(boxesA[:, None, 2], boxesB[None, :, 2])
+    yB = np.minimum(boxesA[:, None, 3], boxesB[None, :, 3])
+    inter = np.clip(xB - xA, 0, None) * np.clip(yB - yA, 0, None)
+    areaA = (boxesA[:, 2] - boxesA[:, 0]) * (boxesA[:, 3] - boxesA[:, 1])
+    areaB = (boxesB[:, 2] - boxesB[:, 0]) * (boxesB[:, 3] - boxesB[:, 1])
+    return inter / np.maximum(areaA[:, None] + areaB[None, :] - inter, 1e-9)
+
+def match_predictions(pred_boxes, pred_conf, gt_boxes) -> np.ndarray:
+    """
+    Greedy matching in descending confidence: (P, T) true-positive flags per IoU threshold,
+    rows in the same order as the inputs.
+    """
+    tp = np.zeros((len(pred_boxes), len(IOU_THRESHOLDS)), dtype=bool)
+    if len(pred_boxes) == 0 or len(gt_boxes) == 0:
+        return tp
+    iou = box_iou(pred_boxes, gt_boxes)
+    for t, threshold in enumerate(IOU_THRESHOLDS):
+        taken = np.zeros(len(gt_boxes), dtype=bool)
+        for i in np.argsort(-pred_conf, kind="stable"):
+            candidates = np.where(~taken & (iou[i] >= threshold), iou[i], -1)
+            best = candidates.argmax()
+            if candidates[best] >= 0:
+                taken[best] = True
+                tp[i, t] = True
+    return tp
+
+def average_precision(tp: np.ndarray, conf: np.ndarray, n_gt: int):
+    """
+    All-point interpolated AP per IoU threshold, plus precision and recall at IoU 0.5 over
+    every prediction (the detector's confidence threshold is the operating point).
+    """
+    if n_gt == 0:
+        return np.full(len(IOU_THRESHOLDS), np.nan), float("nan"), float("nan")
+    if len(conf) == 0:
+        return np.zeros(len(IOU_THRESHOLDS)), 0.0, 0.0
+    order = np.argsort(-conf, kind="stable")
+    ctp = np.cumsum(tp[order], axis=0)
+    cfp = np.cumsum(~tp[order], axis=0)
+    recall = ctp / n_gt
+    precision = ctp / (ctp + cfp)
+    aps = []
+    for t in range(len(IOU_THRESHOLDS)):
+        r = np.concatenate([[0.0], recall[:, t], [1.0]])
+        p = np.concatenate([[1.0], precision[:, t], [0.0]])
+        p = np.maximum.accumulate(p[::-1])[::-1]  # precision envelope
+        aps.append(float(np.sum((r[1:] - r[:-1]) * p[1:])))
+    return np.array(aps), float(precision[-1, 0]), float(recall[-1, 0])
+
+class ModelAccumulator:
+    """Per-class matches of one model collected across images."""
+
+    def __init__(self, class_names):
+        self.class_names = list(class_names)
+        self.tp, self.conf, self.pred_class = [], [], []
+        self.gt_counts = np.zeros(len(self.class_names), dtype=np.int64)
+
+    def add(self, gt_classes, gt_boxes, pred_classes, pred_boxes, pred_conf):
+        self.gt_counts += np.bincount(gt_classes, minlength=len(self.class_names))[:len(self.class_names)]
+        for class_id in np.unique(np.concatenate([gt_classes, pred_classes])):
+            pred_mask = pred_classes == class_id
+            self.tp.append(match_predictions(pred_boxes[pred_mask], pred_conf[pred_mask], gt_boxes[gt_classes == class_id]))
+            self.conf.append(pred_conf[pred_mask])
+            self.pred_class.append(pred_classes[pred_mask])
+
+    def report(self) -> dict:
+        tp = np.concatenate(self.tp) if self.tp else np.zeros((0, len(IOU_THRESHOLDS)), dtype=bool)
+        conf = np.concatenate(self.conf) if self.conf else np.zeros(0)
+        pred_class = np.concatenate(self.pred_class) if self.pred_class else np.zeros(0, dtype=np.int64)
+        per_class, ap50, ap = {}, [], []
+        for class_id, name in enumerate(self.class_names):
+            mask = pred_class == class_id
+            n_gt = int(self.gt_counts[class_id])
+            aps, precision, recall = average_precision(tp[mask], conf[mask], n_gt)
+            if n_gt:
+                ap50.append(aps[0])
+                ap.append(aps.mean())
+            per_class[name] = {
+                "ground_truth": n_gt,
+                "predictions": int(mask.sum()),
+                "precision": None if np.isnan(precision) else round(precision, 4),
+                "recall": None if np.isnan(recall) else round(recall, 4),
+                "ap50": None if np.isnan(aps[0]) else round(float(aps[0]), 4),
+                "ap50_95": None if np.isnan(aps[0]) else round(float(aps.mean()), 4),
+            }
+        return {
+            "map50": round(float(np.mean(ap50)), 4) if ap50 else None,
+            "map50_95": round(float(np.mean(ap)), 4) if ap else None,
+            "classes": per_class,
+        }
+
+def find_images(images_dir):
+    return sorted(path for path in glob.glob(os.path.join(images_dir, "**", "*"), recursive=True) if path.lower().endswith(IMAGE_EXTENSIONS))
+
+def evaluate(images_dir, label_dirs, class_names, workers=None, limit=None, warmup=True):
+    """
+    Evaluate the configured detector on a labelled image set.
+
+    Args:
+        images_dir (str): Directory searched recursively for images.
+        label_dirs (dict): "nodes" and/or "text" -> YOLO label directory.
+        class_names (dict): Same keys -> class names indexed by class id.
+        workers (int, optional): Processes used to load the ground truth.
+        limit (int, optional): Only evaluate the first N images.
+        warmup (bool): Run one warmup pass so the first image's latency is not an outlier.
+
+    Returns:
+        dict: Accuracy per model and inference-time summary.
+    """
+    from .benchmarks.run import summarize
+    from .services.image_processor import get_detector, load_image
+    from .services.labels_conversion import load_ground_truth
+
+    paths = find_images(images_dir)[:limit]
+    started = time.perf_counter()
+    ground_truth = load_ground_truth(paths, label_dirs, workers=workers)
+    load_seconds = time.perf_counter() - started
+    print(f"Loaded ground truth for {len(paths)} images in {load_seconds:.1f}s")
+
+    detector = get_detector()
+    if warmup:
+        detector.warmup()
+    accumulators = {name: ModelAccumulator(class_names[name]) for name in label_dirs}
+    inference_seconds = []
+    for index, entry in enumerate(ground_truth, 1):
+        image = load_image(entry["path"])
+        started = time.perf_counter()
+        nodes, text = detector.detection_pipeline(image)
+        inference_seconds.append(time.perf_counter() - started)
+        predictions = {"nodes": nodes, "text": text}
+        for name, accumulator in accumulators.items():
+            gt_classes, gt_boxes = entry[name]
+            table = predictions[name]
+            accumulator.add(gt_classes, gt_boxes, np.asarray(table.class_id, dtype=np.int64), np.asarray(table.xyxy, dtype=np.float64), np.asarray(table.confidence, dtype=np.float64))
+        if index % 50 == 0:
+            print(f"{index}/{len(ground_truth)} images evaluated")
+
+    return {
+        "images": len(ground_truth),
+        "ground_truth_load_seconds": round(load_seconds, 3),
+        "inference": summarize(inference_seconds),
+        "models": {name: accumulator.report() for name, accumulator in accumulators.items()},
+    }
+
+def main():
+    from .services.labels_conversion import node_class_names
+
+    parser = argparse.ArgumentParser(description="Evaluate detection accuracy and speed against YOLO ground truth.")
+    parser.add_argument("images", help="directory of evaluation images (searched recursively)")
+    parser.add_argument("--nodes-labels", help="YOLO label directory for the nodes model")
+    parser.add_argument("--text-labels", help="YOLO label directory for the text model")
+    parser.add_argument("--nodes-classes", default=",".join(node_class_names), help="comma-separated class names by id")
+    parser.add_argument("--text-classes", default="Text", help="comma-separated class names by id")
+    parser.add_argument("--workers", type=int, default=None, help="processes for ground-truth loading")
+    parser.add_argument("--limit", type=int, default=None, help="only evaluate the first N images")
+    parser.add_argument("--output", help="write the JSON report here")
+    args = parser.parse_args()
+
+    label_dirs = {name: path for name, path in (("nodes", args.nodes_labels), ("text", args.text_labels)) if path}
+    if not label_dirs:
+        parser.error("pass --nodes-labels and/or --text-labels")
+    class_names = {"nodes": args.nodes_classes.split(","), "text": args.text_classes.split(",")}
+    report = evaluate(args.images, label_dirs, class_names, workers=args.workers, limit=args.limit)
+    text = json.dumps(report, indent=4)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+if __name__ == "__main__":
+    main()
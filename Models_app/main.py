@@ -1,70 +1,273 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Request
 from PIL import Image
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, ORJSONResponse, Response
+from starlette.concurrency import run_in_threadpool
 from pathlib import Path
+from contextlib import asynccontextmanager
+import asyncio
+import hashlib
 import io
+import orjson
 import os
-from .services.image_processor import process_image
+import time
+from .models.image_request import ImageRequest
+from .services.image_processor import process_image_async, stream_image, load_image, get_detector, detector_loaded
+from .services.job_queue import JobStore, JobWorkerPool
 from .services.logging_config import LOG_FILE_PATH, app_logger
+from .services.result_cache import result_cache
+from .services.ocr_cache import ocr_cache
+from .services.ocr_scheduler import ocr_scheduler
+from .services.artifact_writer import artifact_writer
+from .processors.image_encoder import crop_encoder
+from .services.vlm_client import get_vlm_client
+from .services.startup import startup_state, run_startup
+from .services.telemetry import HTTP_IN_FLIGHT, HTTP_SECONDS, metrics_payload, start_trace, timing_breakdown
 
-app = FastAPI()
+async def process_job_image(data, image_id, cache_key):
+    return await process_image_async(data, image_id=image_id, cache_key=cache_key, raise_errors=True)
+
+job_store = JobStore()
+job_workers = JobWorkerPool(job_store, process_job_image)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Models load and warm up in the background: /health answers at once, /ready flips when done
+    startup_task = asyncio.create_task(asyncio.to_thread(run_startup))
+    # the writer also expires artifacts of earlier runs, even if this one never writes any
+    artifact_writer.start()
+    await job_workers.start()
+    yield
+    await job_workers.stop()
+    await startup_task
+    await asyncio.to_thread(artifact_writer.flush, 5.0)
+
+# Handlers return ORJSONResponse themselves: a returned dict still goes through the
+# recursive jsonable_encoder first, which costs more than the encoding it saves
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+
+@app.middleware("http")
+async def record_http_metrics(request: Request, call_next):
+    """Request latency histogram (labelled by route template, not raw path) and in-flight gauge."""
+    HTTP_IN_FLIGHT.inc()
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        HTTP_IN_FLIGHT.dec()
+        route = request.scope.get("route")
+        HTTP_SECONDS.labels(request.method, getattr(route, "path", "unmatched"), str(status)).observe(time.perf_counter() - started)
 
 @app.get("/health")
 def health_check():
     """Simple health check endpoint that returns a status OK."""
     return {"status": "ok"}
 
-# Directory to save images
-SAVE_DIR = "saved_images"
-os.makedirs(SAVE_DIR, exist_ok=True)
+@app.get("/ready")
+def readiness_check():
+    """Readiness probe: 200 once models are loaded and warmed up, 503 before (or if startup failed)."""
+    state = startup_state.snapshot()
+    return ORJSONResponse(status_code=200 if state["ready"] else 503, content=state)
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus scrape endpoint: stage latency histograms, in-flight gauges and VLM outcome counters."""
+    payload, content_type = metrics_payload()
+    return Response(content=payload, media_type=content_type)
+
+@app.get("/detection-stats")
+def detection_stats():
+    """Queue depth and batch-size statistics of the YOLO micro-batchers."""
+    if not detector_loaded():
+        return ORJSONResponse(content={"batching": None, "models": {}})
+    detector = get_detector()
+    return ORJSONResponse(content={"batching": detector.batching, "models": detector.batching_stats()})
+
+@app.get("/cache-stats")
+def cache_stats():
+    """Hit/miss counters of the image result cache and the per-crop OCR cache."""
+    return ORJSONResponse(content={"results": result_cache.stats(), "ocr": ocr_cache.stats()})
+
+@app.get("/ocr-stats")
+def ocr_stats():
+    """Adaptive OCR concurrency limit, slots in use and jobs queued per request."""
+    return ORJSONResponse(content=ocr_scheduler.stats())
+
+@app.get("/encoder-stats")
+def encoder_stats():
+    """Images, pixels and bytes encoded for the VLM since startup."""
+    return ORJSONResponse(content=crop_encoder.stats())
+
+@app.get("/artifact-stats")
+def artifact_stats():
+    """Written, dropped and evicted debug artifacts, plus the retained files and bytes."""
+    return ORJSONResponse(content=artifact_writer.stats())
+
+@app.get("/vlm-stats")
+def vlm_stats():
+    """Per-outcome counters, latency percentiles, timeout and breaker state of the VLM client."""
+    return ORJSONResponse(content=get_vlm_client().stats())
+
+# Persisting uploads is only a debugging side effect, the pipeline runs on the in-memory buffer.
+# They go through `artifact_writer` (ARTIFACT_DIR, bounded queue, retention), never the request path.
+SAVE_UPLOADED_IMAGES = os.getenv("SAVE_UPLOADED_IMAGES", "False").lower() == "true"
+
+def encode_png(image):
+    buffer = io.BytesIO()
+    Image.fromarray(image).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+async def prepare_upload(file: UploadFile, apply_orientation_correction: bool):
+    """
+    Read an upload, look it up in the result cache and otherwise decode (and optionally save) it.
+
+    Returns:
+        tuple: (cache_key, cached_result, processed_image, image_path); `cached_result` is None
+        on a miss, and the last two are None on a hit.
+    """
+    data = await file.read()
+
+    # Retries and resubmits of the same scan are served from the result cache
+    cache_key = None
+    if result_cache.enabled:
+        cache_key = await run_in_threadpool(result_cache.make_key, data, apply_orientation_correction=apply_orientation_correction)
+        cached_result = await run_in_threadpool(result_cache.get, cache_key)
+        if cached_result is not None:
+            return cache_key, cached_result, None, None
+
+    # Decode the upload straight to grayscale, this buffer is shared by every later stage
+    processed_image = await run_in_threadpool(load_image, data)
+    
+    # Save the processed image
+    # Named by content hash so concurrent uploads never collide; written in the background
+    image_path = None
+    if SAVE_UPLOADED_IMAGES:
+        digest = await run_in_threadpool(lambda: hashlib.sha256(data).hexdigest()[:32])
+        image_path = artifact_writer.path_for(f"{digest}.png")
+        artifact_writer.submit(image_path, lambda: encode_png(processed_image))
+    return cache_key, None, processed_image, image_path
 
 @app.post("/image-info/")
-async def extract_image_info(file: UploadFile = File(...), apply_orientation_correction: bool = Form(True)):
+async def extract_image_info(file: UploadFile = File(...), apply_orientation_correction: bool = Form(True), include_timings: bool = Form(False)):
     """
     Extracts information from an uploaded image file by processing it through 
     the following steps:
     
-    1. Read the uploaded image
-    2. Convert to grayscale
-    3. Correct image orientation
-    4. Save the processed image
-    5. Process the image with OCR
+    1. Return the cached result if these exact bytes were processed before
+    2. Decode the uploaded image once into a grayscale pixel buffer
+    3. Optionally queue the processed image for saving (SAVE_UPLOADED_IMAGES)
+    4. Run detection and OCR on the in-memory buffer
     
     Args:
         file (UploadFile): The uploaded image file
         apply_orientation_correction (bool): Whether to apply orientation correction
+        include_timings (bool): Add a per-stage timing breakdown under "timings"
         
     Returns:
-        dict: Dictionary containing OCR results
+        ORJSONResponse: Dictionary containing OCR results
         
     Raises:
         HTTPException: If image processing fails
     """
-    # Read the uploaded image
-    image = Image.open(io.BytesIO(await file.read()))
-    
-    # Get original image size
-    original_size = image.size
-    
-    # Convert the image to grayscale as a sample processing step
-    processed_image = image.convert("L")
-    
-    # Get processed image size
-    processed_size = processed_image.size
+    trace = start_trace()
+    cache_key, cached_result, processed_image, image_path = await prepare_upload(file, apply_orientation_correction)
+    if cached_result is not None:
+        response = {"model_api_response":cached_result}
+    else:
+        # Detection runs on a bounded executor and OCR calls are awaited, so the loop stays free
+        ocr_result = await process_image_async(processed_image,image_id=0,image_path=image_path,cache_key=cache_key)
+        response = {"model_api_response":ocr_result}
+
+    timings = timing_breakdown(trace)
+    app_logger.info({"Stage timings": timings})
+    if include_timings:
+        response["timings"] = timings
+    return ORJSONResponse(content=response)
+
+@app.post("/image-info/stream")
+async def stream_image_info(file: UploadFile = File(...), apply_orientation_correction: bool = Form(True), format: str = Form("ndjson")):
+    """
+    Streaming variant of /image-info/. Emits the detections as soon as both detectors
+    have run, then one event per node as its OCR fields arrive, and a final summary
+    carrying the same payload /image-info/ returns.
     
-    # Save the processed image
-    image_path = os.path.join(SAVE_DIR, file.filename)
-    processed_image.save(image_path)
+    Args:
+        file (UploadFile): The uploaded image file
+        apply_orientation_correction (bool): Whether to apply orientation correction
+        format (str): "ndjson" (one JSON object per line) or "sse" (server-sent events)
+        
+    Returns:
+        StreamingResponse: The event stream
+    """
+    if format not in ("ndjson", "sse"):
+        raise HTTPException(status_code=400, detail="format must be 'ndjson' or 'sse'")
+    cache_key, cached_result, processed_image, image_path = await prepare_upload(file, apply_orientation_correction)
+
+    async def events():
+        if cached_result is not None:
+            yield {"event": "summary", "model_api_response": cached_result, "failed_nodes": [], "seconds": 0.0}
+            return
+        async for event in stream_image(processed_image,image_id=0,image_path=image_path,cache_key=cache_key):
+            yield event
+
+    async def body():
+        async for event in events():
+            if format == "sse":
+                yield b"event: " + event["event"].encode() + b"\ndata: " + orjson.dumps(event) + b"\n\n"
+            else:
+                yield orjson.dumps(event, option=orjson.OPT_APPEND_NEWLINE)
+
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    return StreamingResponse(body(), media_type=media_type, headers={"Cache-Control": "no-cache"})
+
+@app.post("/jobs", status_code=202)
+async def submit_job(request: ImageRequest):
+    """
+    Queue an image for asynchronous processing. The image is fetched from `s3_url`
+    by a worker, so ingestion spikes only grow the queue.
     
-    # Call process_image function with saved image path
-    ocr_result = process_image(image_path,image_id=0)  # Assuming process_image is defined elsewhere
+    Returns:
+        dict: The job id to poll with GET /jobs/{job_id}
+    """
+    job_id = await run_in_threadpool(
+        job_store.enqueue, request.image_id, str(request.s3_url), request.apply_orientation_correction
+    )
+    job_workers.notify()
+    return {"job_id": job_id, "status": "queued"}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """
+    Status of a queued job, with its result once done.
     
-    return {"model_api_response":ocr_result}
+    Raises:
+        HTTPException: If the job id is unknown
+    """
+    job = await run_in_threadpool(job_store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return ORJSONResponse(content={
+        "job_id": job["id"],
+        "image_id": job["image_id"],
+        "status": job["status"],
+        "attempts": job["attempts"],
+        "result": job["result"],
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+    })
+
+@app.get("/jobs")
+async def job_counts():
+    """Number of jobs per status."""
+    return await run_in_threadpool(job_store.counts)
 
 @app.get("/download-log")
 async def download_log():
     """
-    Endpoint to download the application log file.
+    Endpoint to download the application log file (NDJSON, one record per line).
     
     Returns:
         StreamingResponse: The log file as a downloadable attachment
@@ -0,0 +1,17 @@
+from typing import List
+from pydantic import BaseModel, ConfigDict, Field, TypeAdapter
+
+class LabelData(BaseModel):
+    """Fields read from one node's text label; names match `NodeData`."""
+    model_config = ConfigDict(extra="forbid")
+
+    name: str = Field(max_length=64)
+    age: str = Field(max_length=16)
+    dob: str  # as written, e.g. "Born 12 March 1950"; VLM_MAX_TOKENS bounds the length
+    diseases: List[str] = Field(max_length=8)
+
+class LabelBatchItem(LabelData):
+    """One entry of a multi-crop response, keyed by the node id the crop was introduced with."""
+    id: int
+
+LABEL_BATCH_ADAPTER = TypeAdapter(List[LabelBatchItem])
@@ -1,4 +1,5 @@
 import math
+import numpy as np
 from ..services.pedigree_tree import PedigreeTree
 
 class BaseProcessor():
@@ -56,6 +57,28 @@ class BaseProcessor():
 
 
 
+    def relative_overlap_matrix(self,boxesA: np.ndarray, boxesB: np.ndarray) -> np.ndarray:
+        '''
+        Vectorized `relative_overlap`: entry [i, j] is the relative area of boxesB[j] overlapping boxesA[i]
+        '''
+        boxesA = np.asarray(boxesA, dtype=np.float64).reshape(-1, 4)
+        boxesB = np.asarray(boxesB, dtype=np.float64).reshape(-1, 4)
+        xA = np.maximum(boxesA[:, None, 0], boxesB[None, :, 0])
+        yA = np.maximum(boxesA[:, None, 1], boxesB[None, :, 1])
+        xB = np.minimum(boxesA[:, None, 2], boxesB[None, :, 2])
+        yB = np.minimum(boxesA[:, None, 3], boxesB[None, :, 3])
+
+        inter_area = np.clip(xB - xA, 0, None) * np.clip(yB - yA, 0, None)
+        boxB_area = (boxesB[:, 2] - boxesB[:, 0] + 1) * (boxesB[:, 3] - boxesB[:, 1] + 1)
+        return inter_area / boxB_area[None, :]
+
+    def calculate_centers(self,boxes: np.ndarray) -> np.ndarray:
+        '''
+        Vectorized `calculate_center`: (N, 2) array of box centers.
+        '''
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        return (boxes[:, :2] + boxes[:, 2:]) / 2
+
     def calculate_center(self,bbox):
         '''
         Calculate the center of a bounding box.
@@ -0,0 +1,130 @@
+import base64
+import os
+import threading
+from dataclasses import dataclass
+import cv2
+import numpy as np
+from PIL import Image
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Encoding of label crops sent to the VLM
+VLM_IMAGE_FORMAT = os.getenv("VLM_IMAGE_FORMAT", "png").lower()          # png | jpeg | webp
+VLM_IMAGE_QUALITY = int(os.getenv("VLM_IMAGE_QUALITY", "90"))            # jpeg / webp only
+VLM_IMAGE_GRAYSCALE = os.getenv("VLM_IMAGE_GRAYSCALE", "True").lower() == "true"
+# Pixel budget of the vision encoder (e.g. max_pixels of the served model), 0 keeps full resolution
+VLM_IMAGE_MAX_PIXELS = int(os.getenv("VLM_IMAGE_MAX_PIXELS", "0"))
+# Side lengths are snapped to multiples of the vision patch size so the server does not resize again
+VLM_IMAGE_PATCH_SIZE = int(os.getenv("VLM_IMAGE_PATCH_SIZE", "0"))
+
+FORMATS = {
+    "png": (".png", "image/png"),
+    "jpeg": (".jpg", "image/jpeg"),
+    "jpg": (".jpg", "image/jpeg"),
+    "webp": (".webp", "image/webp"),
+}
+# zlib level 6, the same size/speed trade-off PIL uses by default
+PNG_COMPRESSION = 6
+
+@dataclass
+class EncodedImage:
+    data: bytes
+    mime_type: str
+    width: int
+    height: int
+
+    @property
+    def base64(self) -> str:
+        return base64.b64encode(self.data).decode("utf-8")
+
+    @property
+    def data_url(self) -> str:
+        return f"data:{self.mime_type};base64,{self.base64}"
+
+    @property
+    def payload_bytes(self) -> int:
+        """Size of the image once base64 encoded into the request body."""
+        return 4 * ((len(self.data) + 2) // 3)
+
+class CropEncoder:
+    """
+    Encodes label crops for the VLM: optional grayscale, downscaling to the model's pixel
+    budget on a patch-aligned grid, and PNG/JPEG/WebP output with the matching MIME type.
+    Keeps process-wide counters of what was encoded.
+    """
+
+    def __init__(self, fmt: str = "png", quality: int = 90, grayscale: bool = True, max_pixels: int = 0, patch_size: int = 0):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unsupported VLM image format: {fmt}. Use one of {sorted(FORMATS)}.")
+        self.extension, self.mime_type = FORMATS[fmt]
+        self.quality = quality
+        if self.extension == ".png":
+            self.params = [cv2.IMWRITE_PNG_COMPRESSION, PNG_COMPRESSION]
+        elif self.extension == ".jpg":
+            self.params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+        else:
+            self.params = [cv2.IMWRITE_WEBP_QUALITY, quality]
+        self.grayscale = grayscale
+        self.max_pixels = max_pixels
+        self.patch_size = patch_size
+        self._lock = threading.Lock()
+        self.counters = {"images": 0, "source_pixels": 0, "encoded_pixels": 0, "encoded_bytes": 0}
+
+    def target_size(self, width: int, height: int) -> tuple:
+        scale = 1.0
+        if self.max_pixels and width * height > self.max_pixels:
+            scale = (self.max_pixels / (width * height)) ** 0.5
+        width, height = width * scale, height * scale
+        if self.patch_size:
+            width = max(self.patch_size, int(width // self.patch_size) * self.patch_size)
+            height = max(self.patch_size, int(height // self.patch_size) * self.patch_size)
+        return max(1, int(width)), max(1, int(height))
+
+    def to_array(self, image) -> np.ndarray:
+        """
+        The crop as a grayscale or BGR array for OpenCV. Arrays (the merged label buffers)
+        are used as they are; PIL images are only accepted for callers outside the pipeline.
+        """
+        if isinstance(image, Image.Image):
+            if image.mode == "L" or self.grayscale:
+                return np.asarray(image.convert("L"))
+            return cv2.cvtColor(np.asarray(image.convert("RGB")), cv2.COLOR_RGB2BGR)
+        if self.grayscale and image.ndim == 3:
+            return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        return image
+
+    def encode(self, image) -> EncodedImage:
+        image = self.to_array(image)
+        height, width = image.shape[:2]
+        source_pixels = width * height
+        size = self.target_size(width, height)
+        if size != (width, height):
+            image = cv2.resize(image, size, interpolation=cv2.INTER_LANCZOS4)
+
+        ok, buffer = cv2.imencode(self.extension, image, self.params)
+        if not ok:
+            raise ValueError(f"Could not encode a {width}x{height} crop as {self.mime_type}")
+        encoded = EncodedImage(buffer.tobytes(), self.mime_type, size[0], size[1])
+
+        with self._lock:
+            self.counters["images"] += 1
+            self.counters["source_pixels"] += source_pixels
+            self.counters["encoded_pixels"] += size[0] * size[1]
+            self.counters["encoded_bytes"] += len(encoded.data)
+        return encoded
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self.counters)
+        counters["format"] = self.mime_type
+        counters["avg_bytes_per_image"] = counters["encoded_bytes"] / counters["images"] if counters["images"] else 0.0
+        return counters
+
+crop_encoder = CropEncoder(
+    fmt=VLM_IMAGE_FORMAT,
+    quality=VLM_IMAGE_QUALITY,
+    grayscale=VLM_IMAGE_GRAYSCALE,
+    max_pixels=VLM_IMAGE_MAX_PIXELS,
+    patch_size=VLM_IMAGE_PATCH_SIZE,
+)
@@ -1,179 +1,567 @@
 
 import json
-import re
-from PIL import Image
 from dotenv import load_dotenv
+from pydantic import ValidationError
 from .base_processor import BaseProcessor
-from ..services.logging_config import app_logger,image_id_var
+from ..services.logging_config import app_logger,image_id_var,HOT_PATH
+from ..services.ocr_cache import ocr_cache, crop_key
+from ..services.ocr_scheduler import ocr_scheduler
+from ..services.telemetry import span, traced
+from .image_encoder import crop_encoder
+from ..models.label_data import LabelData, LABEL_BATCH_ADAPTER
 from ast import literal_eval
 import time
 import os
-import base64
-from openai import OpenAI
-from io import BytesIO
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import asyncio
+import contextvars
+from ..services.vlm_client import get_vlm_client, VLM_MAX_RETRIES, VLM_TIMEOUT_MAX
+from concurrent.futures import as_completed, TimeoutError as FutureTimeoutError
+import numpy as np
 load_dotenv() 
 
-vllm_server_url = os.getenv("VLLM_SERVER_URL")
-vllm_model_id = os.getenv("VLLM_MODEL_ID")
-openai_api_key = "EMPTY"
-openai_api_base = vllm_server_url
-client = OpenAI(
-    api_key=openai_api_key,
-    base_url=openai_api_base,
-)
+# Text-to-node assignment: "nearest" center, or "overlap" (largest relative overlap, nearest as fallback)
+TEXT_ASSIGNMENT_MODE = os.getenv("TEXT_ASSIGNMENT_MODE", "nearest").lower()
+TEXT_ASSIGNMENT_MIN_OVERLAP = float(os.getenv("TEXT_ASSIGNMENT_MIN_OVERLAP", "0.5"))
+# Labels farther than this (pixels) from every node are dropped; unset keeps every label
+TEXT_ASSIGNMENT_MAX_DISTANCE = float(os.getenv("TEXT_ASSIGNMENT_MAX_DISTANCE", "inf"))
+# Switch from a dense distance matrix to a k-d tree above this many nodes
+KDTREE_MIN_NODES = int(os.getenv("KDTREE_MIN_NODES", "64"))
+# Number of label crops packed into one chat completion; 1 keeps one request per crop
+VLM_BATCH_SIZE = max(1, int(os.getenv("VLM_BATCH_SIZE", "1")))
+# "structured" asks vLLM for schema-guided JSON (LabelData) with a short prompt; "freeform" keeps the original prompt
+VLM_OUTPUT_MODE = os.getenv("VLM_OUTPUT_MODE", "freeform").lower()
+STRUCTURED_OUTPUT = VLM_OUTPUT_MODE == "structured"
+# Completion token budget per crop
+VLM_MAX_TOKENS = int(os.getenv("VLM_MAX_TOKENS", "64"))
+# Longest wait for a crop another request is reading before its nodes are marked failed; the
+# default covers the owner's batch call and single-crop fallback, each with its retries
+OCR_WAIT_TIMEOUT = float(os.getenv("OCR_WAIT_TIMEOUT", str(2 * VLM_TIMEOUT_MAX * (VLM_MAX_RETRIES + 1))))
 
-def encode_image(pil_image):
+# OCR tasks that outlive a closed stream: they still publish to the OCR cache and release their claims
+_detached_tasks = set()
+
+def detach(task):
+    """Keep `task` alive after its consumer went away, and swallow its outcome once done."""
+    _detached_tasks.add(task)
+    task.add_done_callback(_detached_tasks.discard)
+    task.add_done_callback(lambda done: done.cancelled() or done.exception())
+
+def release_abandoned(prepare):
+    """Done-callback of a `prepare_crops` whose caller was cancelled: fail the claims it took."""
+    if prepare.cancelled() or prepare.exception() is not None:
+        return
+    owned, _, _ = prepare.result()
+    error = RuntimeError("OCR request was cancelled before reading the crop")
+    for key, _, _ in owned:
+        ocr_cache.release(key, error=error)
+
+def json_schema_format(name, schema):
+    return {"type": "json_schema", "json_schema": {"name": name, "schema": schema, "strict": True}}
+
+LABEL_RESPONSE_FORMAT = json_schema_format("label", LabelData.model_json_schema())
+LABEL_BATCH_RESPONSE_FORMAT = json_schema_format("labels", LABEL_BATCH_ADAPTER.json_schema())
+
+STRUCTURED_INSTRUCTION = "Read this pedigree chart label. Give name, age, dob (as written) and diseases. Use \"\" or [] for anything absent."
+
+# Keys of the free-form prompt mapped onto the LabelData fields
+FREEFORM_KEYS = {"Name": "name", "Age": "age", "Date of Birth": "dob", "Disease": "diseases"}
+EMPTY_LABEL = {"name": "", "age": "", "dob": "", "diseases": []}
+
+def encode_image(image):
     """
-    Encode a PIL Image object to a base64 string.
+    Encode an image to a base64 string with the configured `crop_encoder`.
 
     Args:
-        pil_image (PIL.Image.Image): The PIL Image object to encode.
+        image (np.ndarray | PIL.Image.Image): The image to encode.
 
     Returns:
         str: Base64 encoded string of the image.
     """
-    buffered = BytesIO()
-    pil_image.save(buffered, format="PNG")  # You can specify the format as needed
-    img_bytes = buffered.getvalue()
-    img_base64 = base64.b64encode(img_bytes).decode("utf-8")
-    return img_base64
+    return crop_encoder.encode(image).base64
 
 
-def extract_text_from_image(image,node_id): 
-    instruction = """"Extract the following structured information from the given image and return the output in valid JSON format. Ensure high accuracy in text extraction, preserving names, numbers, and medical terms correctly. The required fields are: {\"Name\": \"<Extracted Name>\", \"Age\": \"<Extracted Age>\", \"Date of Birth\": \"<Extracted Date of Birth (DD-MM-YYYY or YYYY-MM-DD format)>\", \"Disease\": \"<List of Extracted Diseases, if mentioned>\"}. Ensure that the output is well-formatted JSON with no missing or incorrect fields. If a field is not present in the image, return an empty string for that field.
+def build_messages(image):
+    """
+    Build the chat-completion messages asking the VLM to read a label crop.
+
+    Args:
+        image (EncodedImage): The merged label crop, already encoded by `crop_encoder`.
+
+    Returns:
+        list[dict]: Messages for `VLMClient.complete`.
+    """
+    if STRUCTURED_OUTPUT:
+        # the schema carries the field list, so the prompt can stay short
+        instruction = STRUCTURED_INSTRUCTION
+    else:
+        instruction = """"Extract the following structured information from the given image and return the output in valid JSON format. Ensure high accuracy in text extraction, preserving names, numbers, and medical terms correctly. The required fields are: {\"Name\": \"<Extracted Name>\", \"Age\": \"<Extracted Age>\", \"Date of Birth\": \"<Extracted Date of Birth (DD-MM-YYYY or YYYY-MM-DD format)>\", \"Disease\": \"<List of Extracted Diseases, if mentioned>\"}. Ensure that the output is well-formatted JSON with no missing or incorrect fields. If a field is not present in the image, return an empty string for that field.
     ** PLEASE RETRUN ONLY THE JSON IN THE OUTPUT.
 
     """
-    # Getting the Base64 string
-    base64_image = encode_image(image)
-    try:
-        response = client.chat.completions.create(
-            model=vllm_model_id,
-            messages=[
+    return [
+        {
+            "role": "user",
+            "content": [
                 {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": f"{instruction}",
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"},
-                        },
-                    ],
-                }
+                    "type": "text",
+                    "text": f"{instruction}",
+                },
+                {
+                    "type": "image_url",
+                    "image_url": {"url": image.data_url},
+                },
             ],
-            max_tokens=64,
-            timeout=2
-        )
+        }
+    ]
+
 
-        model_response = response.choices[0].message.content
+def extract_text_from_image(image,node_id): 
+    try:
+        model_response = get_vlm_client().complete(build_messages(image), max_tokens=VLM_MAX_TOKENS, response_format=LABEL_RESPONSE_FORMAT if STRUCTURED_OUTPUT else None)
         # app_logger.info(f"Ocr model response:{model_response}")
         return model_response
     except Exception as e:
         app_logger.error(f"Error in calling VLLM API for node {node_id}: {str(e)}")
         return ""
-        
-            
+
+
+async def extract_text_from_image_async(image,node_id):
+    """
+    Non-blocking variant of `extract_text_from_image`.
+    """
+    try:
+        return await get_vlm_client().acomplete(build_messages(image), max_tokens=VLM_MAX_TOKENS, response_format=LABEL_RESPONSE_FORMAT if STRUCTURED_OUTPUT else None)
+    except Exception as e:
+        app_logger.error(f"Error in calling VLLM API for node {node_id}: {str(e)}")
+        return ""
+
+
+def build_batch_messages(images,node_ids):
+    """
+    Build one chat-completion request carrying several label crops, each introduced by its node id.
+
+    Args:
+        images (list[EncodedImage]): Merged label crops, already encoded.
+        node_ids (list[int]): Node id of each crop, echoed back by the model.
+
+    Returns:
+        list[dict]: Messages for `VLMClient.complete`.
+    """
+    if STRUCTURED_OUTPUT:
+        instruction = f"Read the {len(images)} pedigree chart labels below, each preceded by its node id. Give id, name, age, dob (as written) and diseases per label. Use \"\" or [] for anything absent."
+    else:
+        instruction = f"""You are given {len(images)} images of text labels from a pedigree chart, each preceded by its node id. For every image extract {{\"id\": <node id>, \"Name\": \"<Extracted Name>\", \"Age\": \"<Extracted Age>\", \"Date of Birth\": \"<Extracted Date of Birth (DD-MM-YYYY or YYYY-MM-DD format)>\", \"Disease\": \"<List of Extracted Diseases, if mentioned>\"}}. Use an empty string for fields that are not present.
+    ** RETURN ONLY A JSON ARRAY WITH ONE OBJECT PER IMAGE.
+    """
+    content = [{"type": "text", "text": instruction}]
+    for image, node_id in zip(images, node_ids):
+        content.append({"type": "text", "text": f"Node id {node_id}:"})
+        content.append({"type": "image_url", "image_url": {"url": image.data_url}})
+    return [{"role": "user", "content": content}]
+
+
+def extract_text_from_images(images,node_ids):
+    """
+    Read several crops in one VLM call; returns the raw model output or "" on failure.
+    """
+    try:
+        return get_vlm_client().complete(build_batch_messages(images,node_ids), max_tokens=VLM_MAX_TOKENS*len(images), response_format=LABEL_BATCH_RESPONSE_FORMAT if STRUCTURED_OUTPUT else None)
+    except Exception as e:
+        app_logger.error(f"Error in calling VLLM API for nodes {node_ids}: {str(e)}")
+        return ""
+
+
+async def extract_text_from_images_async(images,node_ids):
+    """
+    Non-blocking variant of `extract_text_from_images`.
+    """
+    try:
+        return await get_vlm_client().acomplete(build_batch_messages(images,node_ids), max_tokens=VLM_MAX_TOKENS*len(images), response_format=LABEL_BATCH_RESPONSE_FORMAT if STRUCTURED_OUTPUT else None)
+    except Exception as e:
+        app_logger.error(f"Error in calling VLLM API for nodes {node_ids}: {str(e)}")
+        return ""
+
 
 class TextProcessor(BaseProcessor):
 
+    def parse_diseases(self,value):
+        """Free-form answers give diseases as a list, a list literal ("['DM']") or comma separated text."""
+        if isinstance(value, list):
+            return [str(item).strip() for item in value if str(item).strip()]
+        value = str(value).strip()
+        if value.startswith("["):
+            try:
+                return self.parse_diseases(literal_eval(value))
+            except (ValueError, SyntaxError):
+                value = value.strip("[]")
+        return [item.strip(" '\"") for item in value.split(",") if item.strip(" '\"")]
+
+    def normalize_label(self,response):
+        """
+        Map a parsed answer onto the LabelData fields: free-form keys ("Name", "Age", ...) are
+        renamed, strings stripped and diseases turned into a list.
+        """
+        if not isinstance(response, dict):
+            return dict(EMPTY_LABEL)
+        label = dict(EMPTY_LABEL)
+        for key, value in response.items():
+            field = FREEFORM_KEYS.get(key, key)
+            if field == "diseases":
+                label[field] = self.parse_diseases(value)
+            elif field in label:
+                label[field] = "" if value is None else str(value).strip()
+        return label
+
+    def json_span(self,response_str,opening,closing):
+        """Slice from the first `opening` to the last `closing` bracket (linear scans, no regex)."""
+        start, end = response_str.find(opening), response_str.rfind(closing)
+        return response_str[start:end + 1] if 0 <= start < end else None
+
     def extract_content(self,response_str):
-        # Extract JSON content from LLM response by finding the first { and last }
-        match = re.search(r'\{.*\}', response_str, re.DOTALL)
-        if not match:
-            return {"Name":"", "Disease":"[]","Age":"","Date of Birth":""}
-        
+        """
+        Parse one label answer into LabelData fields. Schema-guided answers validate directly;
+        free-form ones (or a guided answer that failed validation) fall back to the outermost
+        JSON object in the text.
+        """
+        if not response_str:
+            return dict(EMPTY_LABEL)
+        if STRUCTURED_OUTPUT:
+            try:
+                return self.normalize_label(LabelData.model_validate_json(response_str).model_dump())
+            except ValidationError:
+                pass
+        candidate = self.json_span(response_str, "{", "}")
+        if candidate is None:
+            return dict(EMPTY_LABEL)
         try:
-            response = json.loads(match.group(0))  # Convert string to dictionary
+            return self.normalize_label(json.loads(candidate))
         except json.JSONDecodeError:
-            return {"Name":"", "Disease":"[]","Age":"","Date of Birth":""}
-        
-        cleaned_response = {}
-        for key, value in response.items():
-            # Ensure value is a string
-            value = str(value).strip()
-            
-            # Remove values that are empty or incorrect (like non-date values in "Date of Birth")
-            if value:
-                cleaned_response[key] = value
+            return dict(EMPTY_LABEL)
+
+    def update_node(self,node_id,ocr_response,ok=True):
+        if not ok:
+            self.tree.failed_nodes.append(node_id)
+        self.tree.nodes.set_fields(node_id, {
+            "display_name": ocr_response.get("name"),
+            "age": ocr_response.get("age"),
+            "dob": ocr_response.get("dob"),
+            "diseases": ocr_response.get("diseases"),
+        })
+
+    def deduplicate_crops(self,node_text_map):
+        """
+        Collapse identical merged crops so each distinct label is only sent once.
+
+        Returns:
+            list of tuples: [(crop_key, merged_image, [node_ids])]
+        """
+        groups = {}
+        for node_id, image in node_text_map:
+            key = crop_key(image)
+            if key in groups:
+                groups[key][1].append(node_id)
             else:
-                cleaned_response[key] = ""
-        
-        return cleaned_response
+                groups[key] = (image, [node_id])
+        duplicates = len(node_text_map) - len(groups)
+        if duplicates:
+            ocr_cache.count("deduplicated", duplicates)
+        return [(key, image, node_ids) for key, (image, node_ids) in groups.items()]
 
-    def extract_text_from_label(self,node_id, img):
+    def extract_batch_content(self,response_str,node_ids):
+        """
+        Parse a multi-crop response into {node_id: cleaned_response}; ids the model skipped or
+        mangled are simply absent so the caller can fall back to single-crop calls.
+        """
+        if not response_str:
+            return {}
+        items = None
+        if STRUCTURED_OUTPUT:
+            try:
+                items = [item.model_dump() for item in LABEL_BATCH_ADAPTER.validate_json(response_str)]
+            except ValidationError:
+                pass
+        if items is None:
+            candidate = self.json_span(response_str, "[", "]")
+            if candidate is None:
+                return {}
+            try:
+                items = json.loads(candidate)
+            except json.JSONDecodeError:
+                return {}
+        parsed = {}
+        for item in items if isinstance(items, list) else []:
+            if not isinstance(item, dict):
+                continue
+            try:
+                node_id = int(item.pop("id"))
+            except (KeyError, TypeError, ValueError):
+                continue
+            if node_id in node_ids:
+                parsed[node_id] = self.normalize_label(item)
+        return parsed
+
+    def account_payload(self,images):
+        """Record the image bytes of one VLM request against this tree."""
+        self.tree.vlm_payload_bytes.append(sum(image.payload_bytes for image in images))
+
+    def prepare_crops(self):
+        """
+        Group, deduplicate and cache-check the label crops, then encode the ones this request
+        has to send. CPU-only, so the async path runs it in a worker thread.
+
+        Returns:
+            tuple: (owned, waiting, cached) as returned by `claim_crops`, with encoded images in `owned`.
+        """
+        owned, waiting, cached = self.claim_crops(self.deduplicate_crops(self.group_and_merge_labels()))
+        try:
+            with span("encode_image"):
+                owned = [(key, crop_encoder.encode(image), node_ids) for key, image, node_ids in owned]
+        except BaseException as e:
+            # fail the claims, or other requests waiting on these crops would block forever
+            for key, _, _ in owned:
+                ocr_cache.release(key, error=e)
+            raise
+        return owned, waiting, cached
+
+    async def prepare_crops_async(self):
+        """
+        `prepare_crops` in a worker thread. The thread cannot be interrupted, so if this call
+        is cancelled the claims it takes are released as soon as it finishes.
+        """
+        prepare = asyncio.ensure_future(asyncio.to_thread(self.prepare_crops))
+        try:
+            return await asyncio.shield(prepare)
+        except asyncio.CancelledError:
+            prepare.add_done_callback(release_abandoned)
+            raise
+
+    def log_payload(self):
+        sizes = self.tree.vlm_payload_bytes
+        app_logger.info(f"Sent {sum(sizes)} bytes of label images to the VLM in {len(sizes)} requests")
+
+    def claim_crops(self,crops):
+        """
+        Resolve crops against the OCR cache: cache hits are applied right away.
+
+        Returns:
+            tuple: (owned, waiting, cached) where `owned` are crops this request must extract,
+            `waiting` are (future, node_ids) for crops another request is already extracting
+            and `cached` are the node ids filled from the cache.
+        """
+        owned, waiting, cached_nodes = [], [], []
+        for key, image, node_ids in crops:
+            cached, future, owner = ocr_cache.claim(key)
+            if cached is not None:
+                for node_id in node_ids:
+                    self.update_node(node_id,cached)
+                cached_nodes.extend(node_ids)
+            elif owner:
+                owned.append((key, image, node_ids))
+            else:
+                waiting.append((future, node_ids))
+        return owned, waiting, cached_nodes
+
+    def publish_crops(self,batch,responses):
+        """
+        Release the cache claims of a batch and write the responses onto its nodes.
+        `responses` holds one (ocr_response, ok) per crop. Returns the updated node ids.
+        """
+        updated = []
+        for (key, _, node_ids), (ocr_response, ok) in zip(batch, responses):
+            ocr_cache.release(key, ocr_response, ok=ok)
+            for node_id in node_ids:
+                self.update_node(node_id,ocr_response,ok)
+            updated.extend(node_ids)
+        return updated
+
+    def read_crops(self,batch):
+        """
+        OCR a batch of crops, packing them into one request when it holds more than one.
+        Returns one (ocr_response, ok) per crop.
+        """
+        node_ids = [ids[0] for _, _, ids in batch]
+        parsed = {}
+        if len(batch) > 1:
+            images = [image for _, image, _ in batch]
+            self.account_payload(images)
+            parsed = self.extract_batch_content(extract_text_from_images(images,node_ids),node_ids)
+        responses = []
+        for (_, image, _), node_id in zip(batch, node_ids):
+            if node_id in parsed:
+                responses.append((parsed[node_id], True))
+            else:
+                self.account_payload([image])
+                model_response = extract_text_from_image(image,node_id)
+                responses.append((self.extract_content(model_response), bool(model_response)))
+        return responses
+
+    async def read_crops_async(self,batch):
+        """
+        Async `read_crops`. Every VLM call, the batch and each single-crop fallback, takes
+        its own scheduler slot, so concurrent fallbacks count against the global limit.
+        """
+        key = id(self.tree)
+        node_ids = [ids[0] for _, _, ids in batch]
+        parsed = {}
+        if len(batch) > 1:
+            images = [image for _, image, _ in batch]
+            self.account_payload(images)
+            parsed = self.extract_batch_content(await ocr_scheduler.run_async(key, extract_text_from_images_async, images, node_ids),node_ids)
+        missing = [(image, node_id) for (_, image, _), node_id in zip(batch, node_ids) if node_id not in parsed]
+        for image, _ in missing:
+            self.account_payload([image])
+        fallbacks = dict(zip(
+            [node_id for _, node_id in missing],
+            await asyncio.gather(*(ocr_scheduler.run_async(key, extract_text_from_image_async, image, node_id) for image, node_id in missing)),
+        ))
+        responses = []
+        for node_id in node_ids:
+            if node_id in parsed:
+                responses.append((parsed[node_id], True))
+            else:
+                responses.append((self.extract_content(fallbacks[node_id]), bool(fallbacks[node_id])))
+        return responses
+
+    def extract_text_from_label(self,batch):
         image_id_var.set(self.tree.image_id)
-        app_logger.info(f"extracting text from label for node {node_id}")
-        nodes =self.tree.nodes["predictions"]
-        node=nodes[node_id]
-        model_response = extract_text_from_image(img,node_id)
-        ocr_response = self.extract_content(model_response)
-        node["display_name"] = ocr_response.get("Name")
-        node["age"] = ocr_response.get("age")
-        node["dob"] = ocr_response.get("Date of Birth")
+        app_logger.info(f"extracting text from label for node {', '.join(str(ids[0]) for _, _, ids in batch)}", extra=HOT_PATH)
+        try:
+            responses = self.read_crops(batch)
+        except Exception as e:
+            for key, _, _ in batch:
+                ocr_cache.release(key, error=e)
+            raise
+        return self.publish_crops(batch,responses)
+
+    async def extract_text_from_label_async(self,batch):
+        app_logger.info(f"extracting text from label for node {', '.join(str(ids[0]) for _, _, ids in batch)}", extra=HOT_PATH)
+        try:
+            responses = await self.read_crops_async(batch)
+        except BaseException as e:
+            for key, _, _ in batch:
+                ocr_cache.release(key, error=e)
+            raise
+        return self.publish_crops(batch,responses)
+
+    async def wait_for_crop(self,future,node_ids):
+        """Apply the result of a crop another request is extracting, waiting at most OCR_WAIT_TIMEOUT."""
+        try:
+            # shielded: cancelling this waiter must not cancel the owner's future for everyone else
+            ocr_response, ok = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), OCR_WAIT_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.fail_waiting(node_ids, f"no result after {OCR_WAIT_TIMEOUT:.0f}s")
+        except Exception as e:
+            self.fail_waiting(node_ids, str(e))
+        else:
+            for node_id in node_ids:
+                self.update_node(node_id,ocr_response,ok)
+        return node_ids
+
+    def collect_crop(self,future,node_ids,timeout):
+        """Blocking `wait_for_crop`."""
+        try:
+            ocr_response, ok = future.result(timeout=max(0.0, timeout))
+        except FutureTimeoutError:
+            self.fail_waiting(node_ids, f"no result after {OCR_WAIT_TIMEOUT:.0f}s")
+        except Exception as e:
+            self.fail_waiting(node_ids, str(e))
+        else:
+            for node_id in node_ids:
+                self.update_node(node_id,ocr_response,ok)
+
+    def fail_waiting(self,node_ids,reason):
+        """The request reading these nodes' crop failed or stalled: mark them failed with empty fields."""
+        app_logger.warning(f"Crop of nodes {node_ids} read by another request failed: {reason}")
+        for node_id in node_ids:
+            self.update_node(node_id,dict(EMPTY_LABEL),ok=False)
 
     def merge_text_labels(self,text_crops):
         """
         Merge multiple text label crops into a single image (vertically stacked).
         
         Args:
-            text_crops (list[PIL.Image]): List of cropped text images.
+            text_crops (list[np.ndarray]): Cropped text images, views over the decoded buffer.
         
         Returns:
-            PIL.Image: Merged image.
+            np.ndarray: Merged image, in the crops' (grayscale) layout on a white background.
         """
         if not text_crops:
             return None  # No image to merge
 
-        # Get the max width and total height needed
-        max_width = max(img.width for img in text_crops)
-        total_height = sum(img.height for img in text_crops)
-
-        # Create a blank image to paste all crops
-        merged_image = Image.new("RGB", (max_width, total_height), (255, 255, 255))
+        # Size the buffer once: max width and total height
+        max_width = max(crop.shape[1] for crop in text_crops)
+        total_height = sum(crop.shape[0] for crop in text_crops)
+        merged_image = np.full((total_height, max_width) + text_crops[0].shape[2:], 255, dtype=text_crops[0].dtype)
 
-        # Paste images one below another
+        # Copy the crops one below another
         y_offset = 0
-        for img in text_crops:
-            merged_image.paste(img, (0, y_offset))
-            y_offset += img.height  # Move down for the next image
+        for crop in text_crops:
+            merged_image[y_offset:y_offset + crop.shape[0], :crop.shape[1]] = crop
+            y_offset += crop.shape[0]  # Move down for the next image
 
         return merged_image
 
 
-    def group_and_merge_labels(self):
-        text_data= self.tree.text
-        image_path = self.tree.image_path
-        img = Image.open(image_path)
-        nodes = self.tree.nodes
+    def nearest_nodes(self,text_centers: np.ndarray, node_centers: np.ndarray) -> np.ndarray:
         """
-        Group text labels by their closest node, merge images, and return node_id with merged images.
+        Index of the closest node center for every text center, -1 when farther than
+        TEXT_ASSIGNMENT_MAX_DISTANCE.
+        """
+        if len(node_centers) >= KDTREE_MIN_NODES:
+            from scipy.spatial import cKDTree
+            distances, closest = cKDTree(node_centers).query(text_centers, k=1)
+        else:
+            pairwise = np.linalg.norm(text_centers[:, None, :] - node_centers[None, :, :], axis=2)
+            closest = pairwise.argmin(axis=1)
+            distances = pairwise[np.arange(len(text_centers)), closest]
+        return np.where(distances <= TEXT_ASSIGNMENT_MAX_DISTANCE, closest, -1)
+
+    def assign_text_to_nodes(self,text_boxes: np.ndarray, node_boxes: np.ndarray) -> np.ndarray:
+        """
+        Assign every text box to a node.
 
         Args:
-            text_data (dict): Dictionary containing text bounding boxes.
-            nodes (list): List of node bounding boxes.
-            img (PIL.Image): The original image from which text crops are extracted.
+            text_boxes (np.ndarray): (T, 4) text boxes.
+            node_boxes (np.ndarray): (N, 4) node boxes.
 
         Returns:
-            list of tuples: [(node_id, merged_image)]
+            np.ndarray: (T,) node index per text box, -1 for unassigned labels.
+        """
+        if len(text_boxes) == 0 or len(node_boxes) == 0:
+            return np.full(len(text_boxes), -1, dtype=np.int64)
+
+        assignment = self.nearest_nodes(self.calculate_centers(text_boxes), self.calculate_centers(node_boxes))
+        if TEXT_ASSIGNMENT_MODE == "overlap":
+            # relative area of each text box lying inside each node box, shape (N, T)
+            overlaps = self.relative_overlap_matrix(node_boxes, text_boxes)
+            best = overlaps.argmax(axis=0)
+            covered = overlaps[best, np.arange(len(text_boxes))] >= TEXT_ASSIGNMENT_MIN_OVERLAP
+            assignment = np.where(covered, best, assignment)
+        return assignment
+
+    @traced("group_and_merge_labels")
+    def group_and_merge_labels(self):
         """
-        node_text_map = {i: [] for i in range(len(nodes["predictions"]))}  # Mapping: node index -> text crops
+        Group text labels by their closest node, merge images, and return node_id with merged images.
 
-        # Assign text labels to the closest node
-        for text_label in text_data["predictions"]:
-            text_box = self.get_bounding_box(text_label)
-            text_crop = img.crop(text_box)
+        Returns:
+            list of tuples: [(node_id, merged_image)]
+        """
+        img = self.tree.image  # the decoded buffer; crops below are views into it, not copies
 
-            # Find the closest node
-            distances = [self.euclidean_distance(self.calculate_center(text_box), self.calculate_center(self.get_bounding_box(node)))
-                        for node in nodes["predictions"]]
-            closest_node = distances.index(min(distances))
+        # boxes come straight from the columnar tables, no per-box dicts to re-parse
+        text_boxes = self.tree.text.boxes()
+        node_boxes = self.tree.nodes.boxes()
+        assignment = self.assign_text_to_nodes(text_boxes, node_boxes)
 
-            # Store the crop in the corresponding node group
-            node_text_map[closest_node].append(text_crop)
+        height, width = img.shape[:2]
+        crop_boxes = text_boxes.copy()
+        crop_boxes[:, [0, 2]] = crop_boxes[:, [0, 2]].clip(0, width)
+        crop_boxes[:, [1, 3]] = crop_boxes[:, [1, 3]].clip(0, height)
+        node_text_map = {i: [] for i in range(len(node_boxes))}  # Mapping: node index -> text crops
+        for (x1, y1, x2, y2), closest_node in zip(crop_boxes.tolist(), assignment.tolist()):
+            if closest_node >= 0 and x2 > x1 and y2 > y1:
+                node_text_map[closest_node].append(img[y1:y2, x1:x2])
 
         # Merge images for each node and return results
         merged_results = [(node_id, self.merge_text_labels(crops)) for node_id, crops in node_text_map.items() if crops]
@@ -182,21 +570,56 @@ class TextProcessor(BaseProcessor):
 
     def process_text_data(self):
             start_time = time.perf_counter()
-            node_text_map = self.group_and_merge_labels()
+            owned, waiting, _ = self.prepare_crops()
+            # VLM_BATCH_SIZE crops per request; a batch of one is a plain single-crop call
+            batches = [owned[i:i + VLM_BATCH_SIZE] for i in range(0, len(owned), VLM_BATCH_SIZE)]
             results=[]
-            with ThreadPoolExecutor(max_workers=8) as executor:
-                    # Submit all image processing tasks to the executor
-                    future_to_image = {executor.submit(self.extract_text_from_label,node_id,image): image for node_id,image in node_text_map}
-                    for future in as_completed(future_to_image):
-                        image = future_to_image[future]
-                        data = future.result()
-                        results.append(data)
+            # The process-wide scheduler caps and interleaves VLM work across all requests; a batch
+            # makes its fallback calls one after another inside its slot. Each task runs in a
+            # copy of this context so its spans join the request's trace
+            future_to_image = {ocr_scheduler.submit(id(self.tree),contextvars.copy_context().run,self.extract_text_from_label,batch): batch for batch in batches}
+            for future in as_completed(future_to_image):
+                data = future.result()
+                results.append(data)
+            # crops another request was already extracting, all bounded by one deadline
+            deadline = time.monotonic() + OCR_WAIT_TIMEOUT
+            for future, node_ids in waiting:
+                self.collect_crop(future, node_ids, deadline - time.monotonic())
             end_time = time.perf_counter()
+            self.log_payload()
             app_logger.info(f"Time taken to process: {end_time - start_time:.2f} seconds")
             return results
 
+    async def iter_text_data_async(self):
+            """
+            Run the OCR stage on the event loop and yield lists of node ids as soon as their
+            fields are filled in (cache hits first, then each VLM call as it completes).
+            """
+            owned, waiting, cached = await self.prepare_crops_async()
+            batches = [owned[i:i + VLM_BATCH_SIZE] for i in range(0, len(owned), VLM_BATCH_SIZE)]
+            # Hand the claims to tasks before the first yield: if the stream is closed early the
+            # batches still run to completion, releasing their claims and filling the cache.
+            # Each VLM call takes a slot from the process-wide scheduler, shared fairly with every other request
+            batch_tasks = [asyncio.ensure_future(self.extract_text_from_label_async(batch)) for batch in batches]
+            wait_tasks = [asyncio.ensure_future(self.wait_for_crop(future, node_ids)) for future, node_ids in waiting]
+            try:
+                if cached:
+                    yield cached
+                for next_done in asyncio.as_completed(batch_tasks + wait_tasks):
+                    yield await next_done
+            finally:
+                for task in wait_tasks:
+                    task.cancel()
+                for task in batch_tasks:
+                    detach(task)
 
-
-            
-                
-        
+    async def process_text_data_async(self):
+            """
+            Same as `process_text_data` but awaits the VLM calls concurrently on the event loop.
+            """
+            start_time = time.perf_counter()
+            results = [node_ids async for node_ids in self.iter_text_data_async()]
+            end_time = time.perf_counter()
+            self.log_payload()
+            app_logger.info(f"Time taken to process: {end_time - start_time:.2f} seconds")
+            return results
@@ -0,0 +1,191 @@
+import os
+import queue
+import re
+import threading
+import time
+from collections import OrderedDict
+from dotenv import load_dotenv
+from .logging_config import app_logger
+from .telemetry import ARTIFACTS
+
+load_dotenv()
+
+# Debug artifacts (saved uploads, detection plots) are written off the request path
+ARTIFACT_DIR = os.getenv("ARTIFACT_DIR", "saved_images")
+# Artifacts waiting to be written; when full, new ones are dropped instead of slowing a request
+ARTIFACT_QUEUE_SIZE = int(os.getenv("ARTIFACT_QUEUE_SIZE", "64"))
+# Retention: least recently written files are evicted above this size, 0 disables the cap
+ARTIFACT_MAX_BYTES = int(os.getenv("ARTIFACT_MAX_BYTES", "1000000000"))
+# Files older than this are removed, 0 keeps them until the size cap evicts them
+ARTIFACT_MAX_AGE_HOURS = float(os.getenv("ARTIFACT_MAX_AGE_HOURS", "168"))
+# Age-based eviction also runs this often while nothing is being written
+ARTIFACT_RETENTION_INTERVAL = float(os.getenv("ARTIFACT_RETENTION_INTERVAL", "300"))
+
+# Names the writer produces under its root: `<digest>.png` uploads and `<digest>/<plot>.png` plots
+DIGEST_NAME = re.compile(r"[0-9a-f]{32}")
+PLOT_NAMES = ("nodes.png", "text.png")
+
+class ArtifactWriter:
+    """
+    Single background thread that renders and writes debug artifacts from a bounded queue.
+    `submit` never blocks: when the queue is full the artifact is dropped. Every written
+    file is tracked in LRU order (re-writing a path refreshes it) and evicted once the
+    total exceeds `max_bytes` or the file is older than `max_age` seconds, checked after
+    every write and every `retention_interval` seconds. Only files with the writer's own
+    naming are adopted from earlier runs, so a shared root is safe.
+    """
+
+    def __init__(self, root: str, max_queue: int = 64, max_bytes: int = 0, max_age: float = 0, retention_interval: float = 300):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.retention_interval = retention_interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._files = OrderedDict()  # path -> (size, written_at), oldest first
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.counters = {"written": 0, "dropped": 0, "failed": 0, "evicted": 0}
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="artifact-writer", daemon=True)
+            self._thread.start()
+
+    def count(self, outcome: str, value: int = 1):
+        with self._lock:
+            self.counters[outcome] += value
+        ARTIFACTS.labels(outcome).inc(value)
+
+    def path_for(self, name: str) -> str:
+        return os.path.join(self.root, name)
+
+    def submit(self, path: str, render) -> bool:
+        """
+        Queue `render()` (returning the file bytes) to be written to `path`. Rendering also
+        happens on the writer thread. Returns False when the artifact was dropped.
+        """
+        self.start()
+        try:
+            self._queue.put_nowait((path, render))
+            return True
+        except queue.Full:
+            self.count("dropped")
+            return False
+
+    def _run(self):
+        self._scan()
+        while True:
+            try:
+                item = self._queue.get(timeout=self.retention_interval)
+            except queue.Empty:
+                self._enforce_retention()
+                continue
+            if item is None:
+                self._queue.task_done()
+                return
+            path, render = item
+            try:
+                self._write(path, render())
+                self._enforce_retention()
+            except Exception as e:
+                self.count("failed")
+                app_logger.warning(f"Failed to write artifact {path}: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _write(self, path: str, data: bytes):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)  # readers never see a half-written file
+        with self._lock:
+            previous = self._files.pop(path, None)
+            if previous:
+                self._total_bytes -= previous[0]
+            self._files[path] = (len(data), time.time())
+            self._total_bytes += len(data)
+        self.count("written")
+
+    def _owned_files(self):
+        """Files under the root named the way this writer names them; anything else is left alone."""
+        try:
+            entries = list(os.scandir(self.root))
+        except OSError:
+            return
+        for entry in entries:
+            stem, extension = os.path.splitext(entry.name)
+            if entry.is_file() and extension == ".png" and DIGEST_NAME.fullmatch(stem):
+                yield entry.path
+            elif entry.is_dir() and DIGEST_NAME.fullmatch(entry.name):
+                for name in PLOT_NAMES:
+                    path = os.path.join(entry.path, name)
+                    if os.path.isfile(path):
+                        yield path
+
+    def _scan(self):
+        """Adopt artifacts left by previous runs, oldest first, so retention covers them too."""
+        found = []
+        for path in self._owned_files():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            found.append((stat.st_mtime, path, stat.st_size))
+        with self._lock:
+            for mtime, path, size in sorted(found):
+                self._files[path] = (size, mtime)
+                self._total_bytes += size
+        self._enforce_retention()
+
+    def _enforce_retention(self):
+        evict = []
+        with self._lock:
+            cutoff = time.time() - self.max_age if self.max_age else None
+            while self._files:
+                path, (size, written_at) = next(iter(self._files.items()))
+                too_big = self.max_bytes and self._total_bytes > self.max_bytes
+                too_old = cutoff is not None and written_at < cutoff
+                if not (too_big or too_old):
+                    break
+                del self._files[path]
+                self._total_bytes -= size
+                evict.append(path)
+        for path in evict:
+            try:
+                os.remove(path)
+                directory = os.path.dirname(path)
+                if os.path.abspath(directory) != os.path.abspath(self.root):
+                    os.rmdir(directory)  # the plot directory, once its last plot is gone
+            except OSError:
+                pass
+        if evict:
+            self.count("evicted", len(evict))
+
+    def flush(self, timeout: float = None):
+        """Wait until everything queued so far has been written (used on shutdown)."""
+        if self._thread is None:
+            return
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() > deadline:
+                break
+            time.sleep(0.01)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.counters)
+            stats.update(files=len(self._files), bytes=self._total_bytes)
+        stats.update(queued=self._queue.qsize(), max_bytes=self.max_bytes, max_age_seconds=self.max_age)
+        return stats
+
+artifact_writer = ArtifactWriter(
+    ARTIFACT_DIR,
+    max_queue=ARTIFACT_QUEUE_SIZE,
+    max_bytes=ARTIFACT_MAX_BYTES,
+    max_age=ARTIFACT_MAX_AGE_HOURS * 3600,
+    retention_interval=ARTIFACT_RETENTION_INTERVAL,
+)
@@ -0,0 +1,109 @@
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from .logging_config import app_logger
+
+@dataclass
+class _PendingItem:
+    payload: object
+    future: Future = field(default_factory=Future)
+    enqueued_at: float = field(default_factory=time.perf_counter)
+
+class BatchScheduler:
+    """
+    Dynamic micro-batcher shared by concurrent callers.
+
+    Items submitted from any thread are collected for at most `max_wait_ms` (or until
+    `max_batch_size` items are waiting), passed to `run_batch` as one list, and each
+    output is routed back to the future of the caller that submitted the matching input.
+    """
+
+    def __init__(self, run_batch, max_batch_size: int = 8, max_wait_ms: float = 15, name: str = "batch"):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000
+        self.name = name
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+        self._batch_sizes = Counter()
+        self._total_wait = 0.0
+        self._total_run = 0.0
+        self._thread = threading.Thread(target=self._worker, name=f"{name}-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, payload) -> Future:
+        """Queue a single input; the returned future resolves to its output."""
+        item = _PendingItem(payload)
+        self._queue.put(item)
+        return item.future
+
+    def __call__(self, payload):
+        return self.submit(payload).result()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _collect(self, first):
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                # put the sentinel back so the worker stops after this batch
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _worker(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = self._collect(first)
+            started = time.perf_counter()
+            try:
+                outputs = self.run_batch([item.payload for item in batch])
+                if len(outputs) != len(batch):
+                    raise RuntimeError(f"{self.name}: batch of {len(batch)} returned {len(outputs)} outputs")
+            except Exception as e:
+                app_logger.error(f"Batched {self.name} inference failed for {len(batch)} items: {e}")
+                for item in batch:
+                    item.future.set_exception(e)
+            else:
+                for item, output in zip(batch, outputs):
+                    item.future.set_result(output)
+            finished = time.perf_counter()
+            with self._lock:
+                self._batches += 1
+                self._items += len(batch)
+                self._batch_sizes[len(batch)] += 1
+                self._total_wait += sum(started - item.enqueued_at for item in batch)
+                self._total_run += finished - started
+
+    def stats(self) -> dict:
+        """Snapshot of queue depth and batch-size statistics."""
+        with self._lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "batches": self._batches,
+                "items": self._items,
+                "avg_batch_size": self._items / self._batches if self._batches else 0.0,
+                "batch_size_histogram": dict(sorted(self._batch_sizes.items())),
+                "avg_queue_wait_ms": 1000 * self._total_wait / self._items if self._items else 0.0,
+                "avg_batch_run_ms": 1000 * self._total_run / self._batches if self._batches else 0.0,
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000,
+            }
@@ -0,0 +1,105 @@
+from dataclasses import dataclass, field
+import numpy as np
+import supervision as sv
+
+# OCR fields written per node by TextProcessor, in response order
+OCR_FIELDS = ("display_name", "age", "dob", "diseases")
+
+@dataclass
+class DetectionTable:
+    """
+    Columnar detections carried through the pipeline: one array per attribute instead of a
+    dict per box. Converted to the `detections_to_predictions` JSON shape only at the
+    response boundary (`to_predictions`).
+    """
+    xyxy: np.ndarray        # (N, 4) box corners in image pixels
+    confidence: np.ndarray  # (N,)
+    class_id: np.ndarray    # (N,) int
+    class_name: np.ndarray  # (N,) str
+    width: int
+    height: int
+    fields: dict = field(default_factory=dict)  # OCR column -> (N,) object array
+    has_fields: np.ndarray = None               # (N,) bool, rows whose OCR fields were written
+
+    def __post_init__(self):
+        n = len(self.xyxy)
+        for name in OCR_FIELDS:
+            self.fields.setdefault(name, np.full(n, None, dtype=object))
+        if self.has_fields is None:
+            self.has_fields = np.zeros(n, dtype=bool)
+
+    def __len__(self):
+        return len(self.xyxy)
+
+    @classmethod
+    def from_detections(cls, detections: sv.Detections, image: np.ndarray) -> "DetectionTable":
+        n = len(detections)
+        class_name = detections.data.get("class_name")
+        return cls(
+            xyxy=detections.xyxy,
+            confidence=detections.confidence if detections.confidence is not None else np.ones(n, dtype=np.float32),
+            class_id=detections.class_id if detections.class_id is not None else np.zeros(n, dtype=np.int64),
+            class_name=np.asarray(class_name if class_name is not None else [""] * n, dtype=str),
+            width=image.shape[1],
+            height=image.shape[0],
+        )
+
+    @classmethod
+    def from_predictions(cls, data: dict) -> "DetectionTable":
+        """Build a table from the dict-per-box prediction format (e.g. ground truth or cached results)."""
+        predictions = data.get("predictions", [])
+        xywh = np.array([[p["x"], p["y"], p["width"], p["height"]] for p in predictions], dtype=np.float64).reshape(-1, 4)
+        half = xywh[:, 2:] / 2
+        table = cls(
+            xyxy=np.concatenate([xywh[:, :2] - half, xywh[:, :2] + half], axis=1),
+            confidence=np.array([p.get("confidence", 1.0) for p in predictions], dtype=np.float64),
+            class_id=np.array([p.get("class_id", 0) for p in predictions], dtype=np.int64),
+            class_name=np.array([p.get("class", "") for p in predictions], dtype=str),
+            width=data.get("image", {}).get("width", 0),
+            height=data.get("image", {}).get("height", 0),
+        )
+        for i, p in enumerate(predictions):
+            if any(name in p for name in OCR_FIELDS):
+                table.set_fields(i, {name: p.get(name) for name in OCR_FIELDS})
+        return table
+
+    def set_fields(self, index: int, values: dict):
+        for name, value in values.items():
+            self.fields[name][index] = value
+        self.has_fields[index] = True
+
+    def boxes(self) -> np.ndarray:
+        """(N, 4) int64 [x1, y1, x2, y2], truncated like `BaseProcessor.get_bounding_box`."""
+        return np.trunc(self.xyxy).astype(np.int64)
+
+    def row(self, index: int) -> dict:
+        """One box in the prediction dict format."""
+        return self._rows(np.array([index]))[0]
+
+    def _rows(self, indices: np.ndarray) -> list:
+        xyxy = self.xyxy[indices]
+        size = xyxy[:, 2:] - xyxy[:, :2]
+        center = xyxy[:, :2] + size / 2
+        # tolist() converts whole columns at once instead of a float() per value
+        rows = [
+            {"x": x, "y": y, "height": h, "width": w, "confidence": c, "class": name, "class_id": k}
+            for x, y, h, w, c, name, k in zip(
+                center[:, 0].tolist(), center[:, 1].tolist(), size[:, 1].tolist(), size[:, 0].tolist(),
+                self.confidence[indices].tolist(), self.class_name[indices].tolist(), self.class_id[indices].tolist(),
+            )
+        ]
+        for row, index in zip(rows, indices.tolist()):
+            if self.has_fields[index]:
+                row.update({name: self.fields[name][index] for name in OCR_FIELDS})
+        return rows
+
+    def to_predictions(self) -> dict:
+        """The `detections_to_predictions` JSON shape, plus OCR fields on the nodes that have them."""
+        return {
+            "predictions": self._rows(np.arange(len(self))),
+            "image": {"width": self.width, "height": self.height},
+        }
+
+def as_predictions(value):
+    """`to_predictions` for tables; anything else (a cached dict, an empty result) is returned as is."""
+    return value.to_predictions() if isinstance(value, DetectionTable) else value
@@ -1,19 +1,168 @@
 from..processors.text_processor import TextProcessor
 from .pedigree_detector import PedigreeDetector
 from .pedigree_tree import PedigreeTree
-from .logging_config import app_logger
+from .detection_table import as_predictions
+from .logging_config import app_logger, image_id_var
+from .result_cache import result_cache
+from .telemetry import span
+from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import asyncio
+import contextvars
+import time
+import functools
+import io
 import os
-detector = PedigreeDetector()
+import threading
 from dotenv import load_dotenv
 load_dotenv()
 USE_REACT_FLOW = os.getenv("USE_REACT_FLOW", "False").lower() == "true"
 
-def process_image(image_path,image_id):
+_detector = None
+_detector_lock = threading.Lock()
+
+def get_detector():
+    """
+    The process-wide PedigreeDetector, built on first use so importing this module stays cheap.
+    """
+    global _detector
+    if _detector is None:
+        with _detector_lock:
+            if _detector is None:
+                _detector = PedigreeDetector()
+    return _detector
+
+def detector_loaded():
+    return _detector is not None
+
+def detect(image,image_path=None):
+    return get_detector().detection_pipeline(image,image_path=image_path)
+
+def warmup():
+    get_detector().warmup()
+
+# Bounded pool for the CPU-bound YOLO stage so inference never runs on the event loop.
+# With DETECTION_BATCHING this also bounds how many requests can share a batch.
+DETECTION_WORKERS = int(os.getenv("DETECTION_WORKERS", "2"))
+detection_executor = ThreadPoolExecutor(max_workers=DETECTION_WORKERS, thread_name_prefix="detection")
+
+async def run_in_detection_executor(func, *args, **kwargs):
+    """
+    Run `func` on `detection_executor`, carrying the caller's context variables (image_id) along.
+    """
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(detection_executor, functools.partial(ctx.run, func, *args, **kwargs))
+
+def load_image(image):
+    """
+    Decode an image into a grayscale pixel buffer.
+
+    Args:
+        image (bytes | str | np.ndarray): Raw encoded bytes, a path on disk or an
+            already decoded array (returned unchanged).
+
+    Returns:
+        np.ndarray: 2-D uint8 array holding the grayscale image.
+    """
+    if isinstance(image, np.ndarray):
+        return image
+    with span("decode"):
+        if isinstance(image, (bytes, bytearray)):
+            image = io.BytesIO(image)
+        with Image.open(image) as pil_image:
+            return np.asarray(pil_image.convert("L"))
+
+def cache_result(tree,cache_key):
+    """Store a fully successful result; partial OCR results are never cached."""
+    if cache_key and not tree.failed_nodes:
+        result_cache.put(cache_key, as_predictions(tree.nodes))
+
+def process_image(image,image_id,image_path=None,cache_key=None,raise_errors=False):
+    """
+    Run detection and OCR on an image.
+
+    Args:
+        image (np.ndarray | bytes | str): Decoded grayscale buffer, encoded bytes or a path.
+        image_id: Identifier attached to logs and the tree.
+        image_path (str, optional): Where a copy of the image was persisted, if anywhere.
+            Only used to place debug artifacts next to it.
+        cache_key (str, optional): `result_cache` key to store the result under on success.
+        raise_errors (bool): Re-raise pipeline errors instead of returning the partial result.
+
+    Returns:
+        dict: Node predictions enriched with OCR results.
+    """
+    if image_path is None and isinstance(image, str):
+        image_path = image
+    image_id_var.set(image_id)
+    tree = PedigreeTree(image_path=image_path or "",image_id=image_id)
     try:
-        json_data =detector.detection_pipeline(image_path)
-        tree = PedigreeTree(nodes=json_data[0],text=json_data[1],image_path=image_path,image_id=image_id)
+        tree.image = load_image(image)
+        json_data =detect(tree.image,image_path=image_path)
+        tree.nodes, tree.text = json_data
         TextProcessor(tree).process_text_data()
-        return tree.nodes
+        cache_result(tree,cache_key)
+        return as_predictions(tree.nodes)
+    except Exception as e:
+        app_logger.warning(f"Error processing image: {e}",exc_info=True)
+        if raise_errors:
+            raise
+        return as_predictions(tree.nodes)
+
+async def process_image_async(image,image_id,image_path=None,cache_key=None,raise_errors=False):
+    """
+    Event-loop friendly `process_image`: detection runs on `detection_executor` and the
+    VLM calls are awaited through the async client.
+    """
+    if image_path is None and isinstance(image, str):
+        image_path = image
+    image_id_var.set(image_id)
+    tree = PedigreeTree(image_path=image_path or "",image_id=image_id)
+    try:
+        tree.image = await run_in_detection_executor(load_image, image)
+        json_data = await run_in_detection_executor(detect, tree.image, image_path=image_path)
+        tree.nodes, tree.text = json_data
+        await TextProcessor(tree).process_text_data_async()
+        await asyncio.to_thread(cache_result, tree, cache_key)
+        return as_predictions(tree.nodes)
+    except Exception as e:
+        app_logger.warning(f"Error processing image: {e}",exc_info=True)
+        if raise_errors:
+            raise
+        return as_predictions(tree.nodes)
+
+async def stream_image(image,image_id,image_path=None,cache_key=None):
+    """
+    Progressive variant of `process_image_async`, yielding events as results become available:
+
+    - {"event": "detection", "nodes": ..., "text": ...} once both detectors have run
+    - {"event": "node", "node_id": ..., "node": ...} for each node as its OCR completes
+    - {"event": "error", "message": ...} if the pipeline fails part way
+    - {"event": "summary", "model_api_response": ..., "failed_nodes": ..., "seconds": ...} last
+    """
+    if image_path is None and isinstance(image, str):
+        image_path = image
+    image_id_var.set(image_id)
+    tree = PedigreeTree(image_path=image_path or "",image_id=image_id)
+    start_time = time.perf_counter()
+    try:
+        tree.image = await run_in_detection_executor(load_image, image)
+        tree.nodes, tree.text = await run_in_detection_executor(detect, tree.image, image_path=image_path)
+        yield {"event": "detection", "nodes": as_predictions(tree.nodes), "text": as_predictions(tree.text)}
+        text_processor = TextProcessor(tree)
+        async for node_ids in text_processor.iter_text_data_async():
+            for node_id in node_ids:
+                yield {"event": "node", "node_id": node_id, "node": tree.nodes.row(node_id)}
+        text_processor.log_payload()
+        await asyncio.to_thread(cache_result, tree, cache_key)
     except Exception as e:
         app_logger.warning(f"Error processing image: {e}",exc_info=True)
-        return tree.nodes
+        yield {"event": "error", "message": str(e)}
+    yield {
+        "event": "summary",
+        "model_api_response": as_predictions(tree.nodes),
+        "failed_nodes": sorted(set(tree.failed_nodes)),
+        "seconds": round(time.perf_counter() - start_time, 3),
+    }
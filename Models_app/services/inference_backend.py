@@ -0,0 +1,285 @@
+"""
+CPU inference backends for the YOLO detectors.
+
+`INFERENCE_BACKEND=onnx|openvino` makes PedigreeDetector export each PyTorch weights file
+once (cached under MODEL_EXPORT_DIR, keyed by the weights content, image size and INT8
+flag) and run it through ONNX Runtime or OpenVINO with an explicit intra-op thread count.
+Pre-processing is the shared letterbox from `preprocessing.py`; decoding and NMS of the
+raw YOLO head output happen here. `onnxruntime` / `openvino` are only imported when the
+matching backend is selected, so they are needed only on nodes that use them.
+
+Equivalence check and benchmark against the PyTorch model:
+    python -m Models_app.services.inference_backend check image.png --backend onnx
+    python -m Models_app.services.inference_backend benchmark image.png --backend openvino --runs 20
+"""
+import abc
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+import cv2
+import numpy as np
+import supervision as sv
+from dotenv import load_dotenv
+from .logging_config import app_logger
+
+load_dotenv()
+
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "torch").lower()
+# Intra-op threads per model, 0 = all cores (half each when DETECTION_PARALLEL is on)
+INFERENCE_THREADS = int(os.getenv("INFERENCE_THREADS", "0"))
+INFERENCE_INT8 = os.getenv("INFERENCE_INT8", "False").lower() == "true"
+MODEL_EXPORT_DIR = os.getenv("MODEL_EXPORT_DIR", "model_exports")
+# Calibration dataset yaml for OpenVINO INT8 (post-training quantization needs sample images)
+INT8_CALIBRATION_DATA = os.getenv("INT8_CALIBRATION_DATA")
+NMS_IOU = float(os.getenv("NMS_IOU", "0.7"))
+MAX_DETECTIONS = int(os.getenv("MAX_DETECTIONS", "300"))
+
+BACKENDS = ("torch", "onnx", "openvino")
+
+def weights_digest(weights_path: str) -> str:
+    digest = hashlib.sha1()
+    with open(weights_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+def export_model(weights_path: str, backend: str, imgsz: int = 640, int8: bool = False) -> tuple:
+    """
+    Export PyTorch YOLO weights to `backend`, reusing a previous export when present.
+
+    Every process exports into its own scratch directory (ultralytics writes its output next
+    to the weights, so they are copied there first) and the finished export is renamed into
+    place atomically. Concurrent workers exporting the same model never see a partial export;
+    the ones that lose the race discard their copy.
+
+    Returns:
+        tuple: (model_path, class_names) where model_path is the .onnx or OpenVINO .xml file.
+    """
+    stem = Path(weights_path).stem
+    tag = f"{stem}-{weights_digest(weights_path)}-{imgsz}{'-int8' if int8 else ''}"
+    export_dir = Path(MODEL_EXPORT_DIR) / backend / tag
+    names_path = export_dir / "names.json"
+    model_path = export_dir / (f"{stem}.onnx" if backend == "onnx" else f"{stem}.xml")
+    if model_path.exists() and names_path.exists():
+        return str(model_path), {int(k): v for k, v in json.loads(names_path.read_text()).items()}
+
+    from ultralytics import YOLO
+    app_logger.info(f"Exporting {weights_path} to {backend} (imgsz={imgsz}, int8={int8})")
+    started = time.perf_counter()
+    export_dir.parent.mkdir(parents=True, exist_ok=True)
+    scratch = Path(tempfile.mkdtemp(prefix=f".{tag}-", dir=export_dir.parent))
+    try:
+        staging = scratch / "export"
+        staging.mkdir()
+        weights_copy = scratch / Path(weights_path).name
+        shutil.copyfile(weights_path, weights_copy)
+        model = YOLO(str(weights_copy))
+        if backend == "onnx":
+            exported = model.export(format="onnx", imgsz=imgsz, dynamic=True, simplify=True)
+            if int8:
+                # dynamic quantization needs no calibration data
+                from onnxruntime.quantization import QuantType, quantize_dynamic
+                quantize_dynamic(exported, str(staging / model_path.name), weight_type=QuantType.QUInt8)
+            else:
+                shutil.move(exported, staging / model_path.name)
+        elif backend == "openvino":
+            if int8 and not INT8_CALIBRATION_DATA:
+                raise ValueError("INT8_CALIBRATION_DATA must point to a dataset yaml for OpenVINO INT8 export.")
+            options = {"int8": True, "data": INT8_CALIBRATION_DATA} if int8 else {}
+            exported_dir = Path(model.export(format="openvino", imgsz=imgsz, dynamic=True, **options))
+            for item in exported_dir.iterdir():
+                shutil.move(str(item), staging / item.name)
+        else:
+            raise ValueError(f"Unknown inference backend: {backend}. Use one of {BACKENDS}.")
+        names = {int(k): v for k, v in model.names.items()}
+        (staging / names_path.name).write_text(json.dumps(names))
+        try:
+            os.replace(staging, export_dir)
+        except OSError:
+            # another process finished the same export first
+            if not (model_path.exists() and names_path.exists()):
+                raise
+            app_logger.info(f"Using the export of {weights_path} finished by another process")
+            return str(model_path), {int(k): v for k, v in json.loads(names_path.read_text()).items()}
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    app_logger.info(f"Exported {model_path} in {time.perf_counter() - started:.1f} seconds")
+    return str(model_path), names
+
+def decode_yolo_output(output: np.ndarray, conf: float, names: dict, iou: float = NMS_IOU, max_det: int = MAX_DETECTIONS) -> list:
+    """
+    Turn the raw (N, 4 + num_classes, anchors) YOLO head output into per-image Detections
+    in blob coordinates, with class-aware NMS.
+    """
+    detections = []
+    for prediction in output:
+        prediction = prediction.T  # (anchors, 4 + num_classes)
+        scores = prediction[:, 4:]
+        class_id = scores.argmax(axis=1)
+        confidence = scores[np.arange(len(scores)), class_id]
+        keep = confidence >= conf
+        xywh, class_id, confidence = prediction[keep, :4], class_id[keep], confidence[keep]
+        if len(confidence):
+            boxes = np.column_stack([xywh[:, 0] - xywh[:, 2] / 2, xywh[:, 1] - xywh[:, 3] / 2, xywh[:, 2], xywh[:, 3]])
+            kept = cv2.dnn.NMSBoxesBatched(boxes.tolist(), confidence.tolist(), class_id.tolist(), conf, iou)
+            kept = np.asarray(kept, dtype=np.int64).reshape(-1)
+            kept = kept[np.argsort(-confidence[kept])][:max_det]
+            xywh, class_id, confidence = xywh[kept], class_id[kept], confidence[kept]
+        xyxy = np.column_stack([xywh[:, 0] - xywh[:, 2] / 2, xywh[:, 1] - xywh[:, 3] / 2,
+                                xywh[:, 0] + xywh[:, 2] / 2, xywh[:, 1] + xywh[:, 3] / 2]).reshape(-1, 4)
+        detections.append(sv.Detections(
+            xyxy=xyxy.astype(np.float32),
+            confidence=confidence.astype(np.float32),
+            class_id=class_id.astype(int),
+            data={"class_name": np.array([names[int(c)] for c in class_id], dtype=str)},
+        ))
+    return detections
+
+class RuntimeModel(abc.ABC):
+    """An exported detector; `predict` takes a letterboxed NCHW float32 blob."""
+
+    def __init__(self, model_path: str, names: dict, threads: int = 0):
+        self.model_path = model_path
+        self.names = names
+        self.threads = threads
+
+    @abc.abstractmethod
+    def forward(self, blob: np.ndarray) -> np.ndarray:
+        """Raw YOLO head output for the blob."""
+
+    def predict(self, blob: np.ndarray, conf: float) -> list:
+        return decode_yolo_output(self.forward(blob), conf, self.names)
+
+class OnnxRuntimeModel(RuntimeModel):
+    def __init__(self, model_path: str, names: dict, threads: int = 0):
+        super().__init__(model_path, names, threads)
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def forward(self, blob: np.ndarray) -> np.ndarray:
+        return self.session.run(None, {self.input_name: blob})[0]
+
+class OpenVINOModel(RuntimeModel):
+    def __init__(self, model_path: str, names: dict, threads: int = 0):
+        super().__init__(model_path, names, threads)
+        import openvino as ov
+        config = {"PERFORMANCE_HINT": "LATENCY"}
+        if threads:
+            config["INFERENCE_NUM_THREADS"] = threads
+        self.compiled = ov.Core().compile_model(model_path, "CPU", config)
+        self.output = self.compiled.output(0)
+
+    def forward(self, blob: np.ndarray) -> np.ndarray:
+        # a fresh infer request per call keeps concurrent callers independent
+        return self.compiled.create_infer_request().infer({0: blob})[self.output]
+
+def load_runtime_model(weights_path: str, backend: str, imgsz: int = 640, threads: int = 0, int8: bool = INFERENCE_INT8) -> RuntimeModel:
+    model_path, names = export_model(weights_path, backend, imgsz=imgsz, int8=int8)
+    model_class = OnnxRuntimeModel if backend == "onnx" else OpenVINOModel
+    return model_class(model_path, names, threads=threads)
+
+def box_iou(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    xA = np.maximum(a[:, None, 0], b[None, :, 0])
+    yA = np.maximum(a[:, None, 1], b[None, :, 1])
+    xB = np.minimum(a[:, None, 2], b[None, :, 2])
+    yB = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(xB - xA, 0, None) * np.clip(yB - yA, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-9)
+
+def compare_detections(reference: sv.Detections, candidate: sv.Detections, iou_threshold: float = 0.5) -> dict:
+    """
+    Greedy same-class IoU matching of two detection sets.
+    """
+    if len(reference) == 0 or len(candidate) == 0:
+        return {"reference": len(reference), "candidate": len(candidate), "matched": 0,
+                "mean_iou": None, "max_confidence_diff": None}
+    ious = box_iou(reference.xyxy, candidate.xyxy)
+    ious[reference.class_id[:, None] != candidate.class_id[None, :]] = 0
+    matched, used, conf_diffs, match_ious = 0, set(), [], []
+    for i in np.argsort(-reference.confidence):
+        order = [j for j in np.argsort(-ious[i]) if j not in used and ious[i, j] >= iou_threshold]
+        if order:
+            j = order[0]
+            used.add(j)
+            matched += 1
+            match_ious.append(ious[i, j])
+            conf_diffs.append(abs(reference.confidence[i] - candidate.confidence[j]))
+    return {
+        "reference": len(reference),
+        "candidate": len(candidate),
+        "matched": matched,
+        "mean_iou": float(np.mean(match_ious)) if match_ious else None,
+        "max_confidence_diff": float(np.max(conf_diffs)) if conf_diffs else None,
+    }
+
+def _models_from_env():
+    return {"nodes": os.getenv("NODES_MODEL_PATH"), "text": os.getenv("TEXT_MODEL_PATH")}
+
+def _confs_from_env():
+    return {"nodes": float(os.getenv("NODES_MODEL_CONF", "0.5")), "text": float(os.getenv("TEXT_MODEL_CONF", "0.5"))}
+
+def _torch_predict(model, image, conf, imgsz):
+    from .preprocessing import letterbox
+    import torch
+    prepared = letterbox(image, imgsz)
+    result = model(torch.from_numpy(prepared.blob), conf=conf, verbose=False)[0]
+    return prepared.restore(sv.Detections.from_ultralytics(result))
+
+def _runtime_predict(model, image, conf, imgsz):
+    from .preprocessing import letterbox
+    prepared = letterbox(image, imgsz)
+    return prepared.restore(model.predict(prepared.blob, conf)[0])
+
+def main():
+    parser = argparse.ArgumentParser(description="Check and benchmark exported YOLO backends against PyTorch.")
+    parser.add_argument("command", choices=["check", "benchmark"])
+    parser.add_argument("image")
+    parser.add_argument("--backend", choices=["onnx", "openvino"], default="onnx")
+    parser.add_argument("--imgsz", type=int, default=int(os.getenv("DETECTION_IMGSZ", "640")))
+    parser.add_argument("--threads", type=int, default=INFERENCE_THREADS)
+    parser.add_argument("--int8", action="store_true", default=INFERENCE_INT8)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    from ultralytics import YOLO
+    import torch
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    image = cv2.imread(args.image)
+    confs = _confs_from_env()
+    report = {}
+    for name, weights in _models_from_env().items():
+        torch_model = YOLO(weights)
+        runtime_model = load_runtime_model(weights, args.backend, imgsz=args.imgsz, threads=args.threads, int8=args.int8)
+        if args.command == "check":
+            reference = _torch_predict(torch_model, image, confs[name], args.imgsz)
+            candidate = _runtime_predict(runtime_model, image, confs[name], args.imgsz)
+            report[name] = compare_detections(reference, candidate)
+        else:
+            timings = {}
+            for label, predict, model in (("torch", _torch_predict, torch_model), (args.backend, _runtime_predict, runtime_model)):
+                predict(model, image, confs[name], args.imgsz)  # warmup
+                samples = []
+                for _ in range(args.runs):
+                    started = time.perf_counter()
+                    predict(model, image, confs[name], args.imgsz)
+                    samples.append(1000 * (time.perf_counter() - started))
+                timings[label] = {"p50_ms": float(np.percentile(samples, 50)), "p95_ms": float(np.percentile(samples, 95))}
+            timings["speedup_p50"] = timings["torch"]["p50_ms"] / timings[args.backend]["p50_ms"]
+            report[name] = timings
+    print(json.dumps(report, indent=4))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,337 @@
+import asyncio
+import ipaddress
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from urllib.parse import urlsplit
+import httpx
+from dotenv import load_dotenv
+from .logging_config import app_logger, image_id_var
+from .result_cache import result_cache
+
+load_dotenv()
+
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", "jobs/jobs.db")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_FETCH_TIMEOUT = float(os.getenv("JOB_FETCH_TIMEOUT", "30"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# Idle workers re-check the store this often, in case jobs were added by another process
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "1"))
+# A running job is owned by its worker pool for this long and renewed while it runs; a lease
+# that lapses (its process died) lets another pool take the job over
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+# Failed fetches wait JOB_RETRY_BACKOFF * 2**(attempt - 1) seconds before they are retried
+JOB_RETRY_BACKOFF = float(os.getenv("JOB_RETRY_BACKOFF", "5"))
+# Fetched images larger than this are rejected without being read to the end
+JOB_MAX_IMAGE_BYTES = int(os.getenv("JOB_MAX_IMAGE_BYTES", str(50 * 1024 * 1024)))
+JOB_ALLOWED_SCHEMES = {s.strip().lower() for s in os.getenv("JOB_ALLOWED_SCHEMES", "http,https").split(",") if s.strip()}
+# Comma-separated hosts image URLs may point at (".example.com" also matches subdomains). Unset
+# allows any host that resolves to public addresses only, so jobs cannot reach internal endpoints
+JOB_ALLOWED_HOSTS = [h.strip().lower() for h in os.getenv("JOB_ALLOWED_HOSTS", "").split(",") if h.strip()]
+
+class FetchRejected(ValueError):
+    """The image URL or response violates the fetch policy; retrying cannot help."""
+
+def host_allowed(host: str) -> bool:
+    return any(host == allowed or (allowed.startswith(".") and host.endswith(allowed)) for allowed in JOB_ALLOWED_HOSTS)
+
+async def check_url(url: str):
+    """
+    Enforce JOB_ALLOWED_SCHEMES and JOB_ALLOWED_HOSTS on a URL (also called for every redirect).
+
+    Raises:
+        FetchRejected: If the URL may not be fetched.
+    """
+    parts = urlsplit(url)
+    host = (parts.hostname or "").lower()
+    if parts.scheme.lower() not in JOB_ALLOWED_SCHEMES or not host:
+        raise FetchRejected(f"URL scheme or host not allowed: {url}")
+    if JOB_ALLOWED_HOSTS:
+        if not host_allowed(host):
+            raise FetchRejected(f"Host {host} is not in JOB_ALLOWED_HOSTS")
+        return
+    # resolution errors propagate as network errors and are retried like any failed fetch
+    infos = await asyncio.get_running_loop().getaddrinfo(host, parts.port or (443 if parts.scheme.lower() == "https" else 80))
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split("%")[0])
+        if not address.is_global:
+            raise FetchRejected(f"Host {host} resolves to non-public address {address}")
+
+class JobStore:
+    """
+    SQLite-backed job queue shared by every worker process. Jobs move queued -> running ->
+    done | failed. A running job records its owner and a lease that the owner renews; only
+    jobs whose lease has expired are taken back, so a restart never steals live work.
+    """
+
+    def __init__(self, db_path: str = JOB_DB_PATH):
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    image_id TEXT NOT NULL,
+                    source_url TEXT NOT NULL,
+                    apply_orientation_correction INTEGER NOT NULL,
+                    status TEXT NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    owner TEXT,
+                    lease_until REAL,
+                    not_before REAL NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+            # stores created before leases were added
+            columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+            for column, definition in (
+                ("owner", "TEXT"),
+                ("lease_until", "REAL"),
+                ("not_before", "REAL NOT NULL DEFAULT 0"),
+            ):
+                if column not in columns:
+                    self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {definition}")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at)")
+
+    def enqueue(self, image_id: str, source_url: str, apply_orientation_correction: bool = True) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, image_id, source_url, apply_orientation_correction, status, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, 'queued', ?, ?)",
+                (job_id, image_id, source_url, int(apply_orientation_correction), now, now),
+            )
+        return job_id
+
+    def claim_next(self, owner: str, lease: float = JOB_LEASE_SECONDS):
+        """
+        Atomically move the oldest queued job that is due to running under `owner`, leased
+        for `lease` seconds, and return it, or None.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                row = self._conn.execute(
+                    "SELECT * FROM jobs WHERE status = 'queued' AND not_before <= ? ORDER BY created_at LIMIT 1",
+                    (now,),
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE jobs SET status = 'running', attempts = attempts + 1, owner = ?, lease_until = ?, "
+                        "updated_at = ? WHERE id = ?",
+                        (owner, now + lease, now, row["id"]),
+                    )
+                    row = dict(
+                        row,
+                        status="running",
+                        attempts=row["attempts"] + 1,
+                        owner=owner,
+                        # same type as /image-info/ passes, so both share result cache keys
+                        apply_orientation_correction=bool(row["apply_orientation_correction"]),
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return row
+
+    def renew(self, job_id: str, owner: str, lease: float = JOB_LEASE_SECONDS) -> bool:
+        """Extend the lease on a running job; False if `owner` no longer holds it."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND owner = ? AND status = 'running'",
+                (time.time() + lease, job_id, owner),
+            )
+        return cursor.rowcount == 1
+
+    def _finish(self, job_id: str, owner: str, status: str, result=None, error: str = None, not_before: float = 0):
+        # a pool that lost its lease must not overwrite the job's new owner
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, owner = NULL, lease_until = NULL, "
+                "not_before = ?, updated_at = ? WHERE id = ? AND owner = ? AND status = 'running'",
+                (status, json.dumps(result) if result is not None else None, error, not_before, time.time(), job_id, owner),
+            )
+
+    def complete(self, job_id: str, owner: str, result):
+        self._finish(job_id, owner, "done", result=result)
+
+    def fail(self, job_id: str, owner: str, error: str, retry_in: float = None):
+        """Mark a job failed, or queue it again after `retry_in` seconds."""
+        if retry_in is None:
+            self._finish(job_id, owner, "failed", error=error)
+        else:
+            self._finish(job_id, owner, "queued", error=error, not_before=time.time() + retry_in)
+
+    def requeue_expired(self) -> int:
+        """Queue again the running jobs whose owner stopped renewing the lease (crashed process)."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = 'queued', owner = NULL, lease_until = NULL, updated_at = ? "
+                "WHERE status = 'running' AND (lease_until IS NULL OR lease_until < ?)",
+                (time.time(), time.time()),
+            )
+        return cursor.rowcount
+
+    def requeue_owned(self, owner: str) -> int:
+        """Queue again the running jobs of `owner`, e.g. the ones interrupted by its shutdown."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = 'queued', owner = NULL, lease_until = NULL, updated_at = ? "
+                "WHERE status = 'running' AND owner = ?",
+                (time.time(), owner),
+            )
+        return cursor.rowcount
+
+    def get(self, job_id: str):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        job["apply_orientation_correction"] = bool(job["apply_orientation_correction"])
+        return job
+
+    def counts(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        return {row["status"]: row["n"] for row in rows}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class JobWorkerPool:
+    """
+    Asyncio workers that drain a JobStore: fetch the image over HTTP(S) (S3 presigned
+    URLs, MinIO or any plain HTTP server), run the pipeline and store the result.
+    """
+
+    def __init__(self, store: JobStore, process, workers: int = JOB_WORKERS):
+        self.store = store
+        self.process = process  # async callable(data, image_id, cache_key) -> result
+        self.workers = workers
+        # identifies this pool's leases in the shared store
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._tasks = []
+        self._wakeup = None
+        self._http = None
+
+    def notify(self):
+        """Wake an idle worker after a job was enqueued."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def start(self):
+        requeued = await asyncio.to_thread(self.store.requeue_expired)
+        if requeued:
+            app_logger.info(f"Re-queued {requeued} jobs whose lease expired")
+        self._wakeup = asyncio.Event()
+        self._http = httpx.AsyncClient(
+            timeout=JOB_FETCH_TIMEOUT,
+            follow_redirects=True,
+            event_hooks={"request": [lambda request: check_url(str(request.url))]},
+        )
+        self._tasks = [asyncio.create_task(self._worker(), name=f"job-worker-{i}") for i in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._http is not None:
+            await self._http.aclose()
+        # jobs interrupted by the shutdown are picked up again on the next start
+        await asyncio.to_thread(self.store.requeue_owned, self.owner)
+
+    async def fetch(self, url: str) -> bytes:
+        """Download an image, streamed so at most JOB_MAX_IMAGE_BYTES are ever held."""
+        async with self._http.stream("GET", url) as response:
+            response.raise_for_status()
+            length = response.headers.get("content-length")
+            if length and length.isdigit() and int(length) > JOB_MAX_IMAGE_BYTES:
+                raise FetchRejected(f"Image of {length} bytes exceeds JOB_MAX_IMAGE_BYTES")
+            chunks, total = [], 0
+            async for chunk in response.aiter_bytes():
+                total += len(chunk)
+                if total > JOB_MAX_IMAGE_BYTES:
+                    raise FetchRejected(f"Image exceeds JOB_MAX_IMAGE_BYTES ({JOB_MAX_IMAGE_BYTES})")
+                chunks.append(chunk)
+        return b"".join(chunks)
+
+    async def _worker(self):
+        while True:
+            try:
+                job = await asyncio.to_thread(self.store.claim_next, self.owner)
+            except Exception as e:
+                # e.g. the database is locked by another process for longer than the busy timeout
+                app_logger.error(f"Could not claim a job: {e}")
+                await asyncio.sleep(JOB_POLL_SECONDS)
+                continue
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=JOB_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heartbeat = asyncio.create_task(self._heartbeat(job["id"]))
+            try:
+                await self.run_job(job)
+            finally:
+                heartbeat.cancel()
+
+    async def _heartbeat(self, job_id: str):
+        """Renew the job's lease while it runs."""
+        while True:
+            await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+            try:
+                if not await asyncio.to_thread(self.store.renew, job_id, self.owner):
+                    app_logger.warning(f"Lost the lease on job {job_id}")
+                    return
+            except Exception as e:
+                app_logger.error(f"Could not renew the lease on job {job_id}: {e}")
+
+    async def run_job(self, job: dict):
+        image_id_var.set(job["image_id"])
+        app_logger.info(f"Running job {job['id']} (attempt {job['attempts']})")
+        try:
+            data = await self.fetch(job["source_url"])
+        except Exception as e:
+            # network errors are worth another try, up to JOB_MAX_ATTEMPTS
+            retry = job["attempts"] < JOB_MAX_ATTEMPTS and not isinstance(e, FetchRejected) and not (
+                isinstance(e, httpx.HTTPStatusError) and e.response.status_code < 500
+            )
+            retry_in = JOB_RETRY_BACKOFF * 2 ** (job["attempts"] - 1) if retry else None
+            app_logger.warning(f"Could not fetch image for job {job['id']}: {e}")
+            await asyncio.to_thread(self.store.fail, job["id"], self.owner, f"fetch failed: {e}", retry_in)
+            return
+        try:
+            cache_key = None
+            if result_cache.enabled:
+                cache_key = await asyncio.to_thread(
+                    result_cache.make_key, data, apply_orientation_correction=job["apply_orientation_correction"]
+                )
+            result = await asyncio.to_thread(result_cache.get, cache_key)
+            if result is None:
+                result = await self.process(data, job["image_id"], cache_key)
+        except Exception as e:
+            await asyncio.to_thread(self.store.fail, job["id"], self.owner, f"{type(e).__name__}: {e}")
+            return
+        await asyncio.to_thread(self.store.complete, job["id"], self.owner, result)
+        app_logger.info(f"Job {job['id']} done")
@@ -1,31 +1,90 @@
-import cv2
+import functools
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from PIL import Image
 import supervision as sv
 
+# EXIF Orientation tag; values 5-8 mean the stored pixels are rotated by 90 degrees
+EXIF_ORIENTATION = 0x0112
+
+def image_size(img_path):
+    """
+    (width, height) of an image as displayed, read from its file header; the pixels are never
+    decoded. Like ultralytics' `exif_size`, EXIF rotations by 90 degrees swap the two.
+    """
+    with Image.open(img_path) as image:
+        width, height = image.size
+        try:
+            orientation = image.getexif().get(EXIF_ORIENTATION)
+        except Exception:
+            orientation = None
+    return (height, width) if orientation in (5, 6, 7, 8) else (width, height)
+
+def read_yolo_labels(label_path):
+    """
+    Parse a YOLO label file.
+
+    Box rows must hold exactly five fields (class, center-x, center-y, width, height). Polygon
+    (segmentation) rows, a class followed by three or more x y pairs, are reduced to the box
+    spanning their min/max coordinates.
+
+    Returns:
+        tuple: (class_ids (N,) int64, boxes (N, 4) float64 normalised center-x, center-y, width, height).
+
+    Raises:
+        ValueError: If a row is neither a box nor a polygon (e.g. a trailing confidence column).
+    """
+    if not os.path.exists(label_path):
+        return np.empty(0, dtype=np.int64), np.empty((0, 4), dtype=np.float64)
+    with open(label_path, "r") as f:
+        lines = [line.split() for line in f if line.strip()]
+    if not lines:
+        return np.empty(0, dtype=np.int64), np.empty((0, 4), dtype=np.float64)
+    if all(len(fields) == 5 for fields in lines):
+        values = np.array(lines, dtype=np.float64)
+        return values[:, 0].astype(np.int64), values[:, 1:]
+
+    class_ids, boxes = [], []
+    for number, fields in enumerate(lines, start=1):
+        if len(fields) == 5:
+            box = [float(v) for v in fields[1:]]
+        elif len(fields) >= 7 and len(fields) % 2 == 1:
+            points = np.array(fields[1:], dtype=np.float64).reshape(-1, 2)
+            (x1, y1), (x2, y2) = points.min(axis=0), points.max(axis=0)
+            box = [(x1 + x2) / 2, (y1 + y2) / 2, x2 - x1, y2 - y1]
+        else:
+            raise ValueError(
+                f"{label_path}:{number}: expected 5 fields or a polygon, got {len(fields)}"
+            )
+        class_ids.append(int(float(fields[0])))
+        boxes.append(box)
+    return np.array(class_ids, dtype=np.int64), np.array(boxes, dtype=np.float64).reshape(-1, 4)
+
+def yolo_to_xyxy(boxes, width, height):
+    """Denormalise YOLO center/size boxes into (N, 4) pixel [x1, y1, x2, y2]."""
+    scale = np.array([width, height, width, height], dtype=np.float64)
+    xywh = boxes * scale
+    half = xywh[:, 2:] / 2
+    return np.concatenate([xywh[:, :2] - half, xywh[:, :2] + half], axis=1)
+
 def convert_label_to_prediction(img_path, label_path, class_names):
-    image = cv2.imread(img_path)
-    h, w, _ = image.shape
-    predictions = []
-    with open(label_path, 'r') as f:
-        for line in f:
-            parts = list(map(float, line.split()))
-            class_id = int(parts[0])
-            center_x_norm, center_y_norm, width_norm, height_norm = parts[1:]
-
-            # Denormalize the coordinates
-            x = center_x_norm * w
-            y = center_y_norm * h
-            width = width_norm * w
-            height = height_norm * h
-            predictions.append({
-                "x": float(x),
-                "y": float(y),
-                "width": float(width),
-                "height": float(height),
-                "confidence": 1,  
-                "class": class_names[class_id],
-                "class_id": class_id,
-                "image_path": img_path,
-            })
+    w, h = image_size(img_path)
+    class_ids, boxes = read_yolo_labels(label_path)
+    xywh = boxes * np.array([w, h, w, h], dtype=np.float64)
+    predictions = [
+        {
+            "x": x,
+            "y": y,
+            "width": width,
+            "height": height,
+            "confidence": 1,
+            "class": class_names[class_id],
+            "class_id": class_id,
+            "image_path": img_path,
+        }
+        for class_id, (x, y, width, height) in zip(class_ids.tolist(), xywh.tolist())
+    ]
 
     return {
         "predictions": predictions,
@@ -35,6 +94,39 @@ def convert_label_to_prediction(img_path, label_path, class_names):
         }
     }
 
+def load_ground_truth_entry(img_path, label_dirs):
+    """
+    Ground truth of one image: its size plus, per label set, (class_ids, xyxy pixel boxes).
+    `label_dirs` maps a name (e.g. "nodes") to the directory holding `<image stem>.txt`.
+    """
+    w, h = image_size(img_path)
+    stem = os.path.splitext(os.path.basename(img_path))[0]
+    entry = {"path": img_path, "width": w, "height": h}
+    for name, label_dir in label_dirs.items():
+        class_ids, boxes = read_yolo_labels(os.path.join(label_dir, stem + ".txt"))
+        entry[name] = (class_ids, yolo_to_xyxy(boxes, w, h))
+    return entry
+
+def load_ground_truth(img_paths, label_dirs, workers=None, chunksize=32):
+    """
+    Load the ground truth of many images, fanned out across processes in chunks.
+
+    Args:
+        img_paths (list[str]): Images to load.
+        label_dirs (dict): Label set name -> directory of YOLO .txt files.
+        workers (int, optional): Process count; 1 loads in-process.
+        chunksize (int): Images handed to a worker at a time.
+
+    Returns:
+        list[dict]: One `load_ground_truth_entry` per image, in input order.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(img_paths) < 2 * chunksize:
+        return [load_ground_truth_entry(path, label_dirs) for path in img_paths]
+    load = functools.partial(load_ground_truth_entry, label_dirs=label_dirs)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(load, img_paths, chunksize=chunksize))
+
 node_class_names = ["Female", "Male", "Miscarriage", "Unknown"]
 edge_class_names = ["Dz", "Horizontal_edge", "Mz", "Vertical_edge"]
 symbol_class_names = ["Adopted_in", "Adopted_out", "Carrier", "Deceased", "Divorce", "Patient"]
@@ -92,7 +184,7 @@ def detections_to_predictions(detections, image):
         
         predictions.append(prediction)
     
-    image_height, image_width, _ = image.shape
+    image_height, image_width = image.shape[:2]
     
     output_json = {
         "predictions": predictions,
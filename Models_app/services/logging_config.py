@@ -1,24 +1,37 @@
 import logging
 import json
 import os
+import atexit
+import queue
+import random
 import contextvars
 from pathlib import Path
 from dotenv import load_dotenv
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 
 # Load environment variables
 load_dotenv()
 LOG_FILE_PATH = os.getenv("LOG_FILE_PATH", "logs/app.log")
+# Records waiting for the listener thread; when full, new records are dropped rather than block a request
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Fraction of hot-path records kept per level, e.g. "INFO=0.1,DEBUG=0"; unlisted levels keep everything
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "")
 
 # Context variable to store `image_id` dynamically
 image_id_var = contextvars.ContextVar("image_id", default=None)
 
+# Pass as `extra=HOT_PATH` on per-crop / per-call messages that are subject to sampling
+HOT_PATH = {"hot_path": True}
+
 class JSONFormatter(logging.Formatter):
-    """Custom JSON formatter that automatically adds image_id from context."""
+    """Compact single-line JSON (NDJSON) formatter that adds image_id from context."""
     def format(self, record):
-        record.image_id = image_id_var.get()  # Fetch image_id dynamically
+        # set by ContextQueueHandler on the logging thread; fall back for direct handlers
+        image_id = getattr(record, "image_id", None)
+        if image_id is None:
+            image_id = image_id_var.get()
         log_data = {
-            "image_id": record.image_id ,
+            "image_id": image_id,
             "message": record.getMessage(),
             "timestamp": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
             "level": record.levelname,
@@ -26,10 +39,57 @@ class JSONFormatter(logging.Formatter):
             "function": record.funcName,
             "line": record.lineno,
         }
-        return json.dumps(log_data,indent=4)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            log_data["exception"] = record.exc_text
+        return json.dumps(log_data, separators=(",", ":"), default=str)
+
+class ContextQueueHandler(QueueHandler):
+    """
+    Enqueue records for the listener thread. The image_id context variable and the
+    message/traceback are resolved here, on the calling thread, since the listener
+    runs in its own context.
+    """
+    def prepare(self, record):
+        record.image_id = image_id_var.get()
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass  # shedding logs beats stalling the request path
+
+class SamplingFilter(logging.Filter):
+    """Keep only a fraction of hot-path records per level; other records always pass."""
+    def __init__(self, rates: dict):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record):
+        if not getattr(record, "hot_path", False):
+            return True
+        rate = self.rates.get(record.levelno, 1.0)
+        return rate >= 1.0 or random.random() < rate
+
+def parse_sample_rates(spec: str) -> dict:
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        level, _, rate = item.partition("=")
+        rates[logging.getLevelName(level.strip().upper())] = float(rate)
+    return rates
 
 def setup_logger(logger_name, log_file, level=logging.INFO):
-    """Set up a structured logger with JSON format and rotating file handler."""
+    """
+    Set up a structured logger: callers only enqueue, a QueueListener thread formats
+    NDJSON and writes the rotating file.
+    """
     log_path = Path(log_file)
     log_path.parent.mkdir(parents=True, exist_ok=True)  # Ensure directory exists
 
@@ -38,12 +98,19 @@ def setup_logger(logger_name, log_file, level=logging.INFO):
     if logger.hasHandlers():
         return logger  # Prevent duplicate handlers
 
-    formatter = JSONFormatter()
-    handler = RotatingFileHandler(log_file, maxBytes=10_000_000, backupCount=5)
-    handler.setFormatter(formatter)
+    file_handler = RotatingFileHandler(log_file, maxBytes=10_000_000, backupCount=5)
+    file_handler.setFormatter(JSONFormatter())
+
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    queue_handler = ContextQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(parse_sample_rates(LOG_SAMPLE_RATES)))
+    listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)  # drains the queue before the process exits
 
     logger.setLevel(level)
-    logger.addHandler(handler)
+    logger.addHandler(queue_handler)
+    logger.propagate = False
 
     return logger
 
@@ -0,0 +1,105 @@
+import hashlib
+import os
+import threading
+from concurrent.futures import Future
+import cv2
+import numpy as np
+from PIL import Image
+from dotenv import load_dotenv
+from .result_cache import LRUCache
+
+load_dotenv()
+
+OCR_CACHE_SIZE = int(os.getenv("OCR_CACHE_SIZE", "4096"))
+# "exact" hashes the pixels, "perceptual" a difference hash that also matches near-identical crops
+OCR_CACHE_HASH = os.getenv("OCR_CACHE_HASH", "exact").lower()
+# Resolution of the perceptual hash grid; text needs a finer grid than photo dHashes
+PERCEPTUAL_HASH_SIZE = (32, 16)
+
+def as_array(image) -> np.ndarray:
+    return np.asarray(image) if isinstance(image, Image.Image) else image
+
+def exact_hash(image) -> str:
+    image = as_array(image)
+    digest = hashlib.sha1(f"{image.dtype}{image.shape}".encode())
+    digest.update(np.ascontiguousarray(image).data)  # hashes the buffer in place
+    return digest.hexdigest()
+
+def perceptual_hash(image) -> str:
+    """
+    Difference hash of the crop plus its size rounded to 8px, so labels that only differ
+    by compression noise or a pixel of detector jitter share an entry.
+    """
+    image = as_array(image)
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    width, height = PERCEPTUAL_HASH_SIZE
+    pixels = cv2.resize(image, (width + 1, height), interpolation=cv2.INTER_LINEAR).astype(np.int16)
+    bits = np.packbits(pixels[:, 1:] > pixels[:, :-1])
+    size_bucket = f"{round(image.shape[1] / 8)}x{round(image.shape[0] / 8)}"
+    return f"{size_bucket}:{bits.tobytes().hex()}"
+
+def crop_key(image) -> str:
+    return perceptual_hash(image) if OCR_CACHE_HASH == "perceptual" else exact_hash(image)
+
+class OcrCache:
+    """
+    Memoizes parsed OCR results per crop hash and collapses concurrent lookups of the
+    same crop into a single in-flight VLM call (single flight), across requests and threads.
+    """
+
+    def __init__(self, max_entries: int = 4096):
+        self.results = LRUCache(max_entries)
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "coalesced": 0, "deduplicated": 0}
+
+    def count(self, counter: str, value: int = 1):
+        with self._lock:
+            self.counters[counter] += value
+
+    def claim(self, key: str):
+        """
+        Look a crop up.
+
+        Returns:
+            tuple: (cached_value, None, False) on a hit, (None, future, False) when another
+            caller is already extracting it, or (None, future, True) when the caller owns the
+            extraction and must call `release`.
+        """
+        value = self.results.get(key)
+        if value is not None:
+            self.count("hits")
+            return value, None, False
+        with self._lock:
+            if key in self._inflight:
+                self.counters["coalesced"] += 1
+                return None, self._inflight[key], False
+            future = Future()
+            self._inflight[key] = future
+            self.counters["misses"] += 1
+            return None, future, True
+
+    def release(self, key: str, value=None, ok: bool = True, error: Exception = None):
+        """Publish the owner's result to waiters; only successful results are memoized."""
+        if ok and error is None:
+            self.results.put(key, value)
+        with self._lock:
+            future = self._inflight.pop(key, None)
+        if future is None:
+            return
+        if error is not None:
+            if not isinstance(error, Exception):
+                # a cancelled owner must not surface as a cancellation inside the waiters
+                error = RuntimeError(f"OCR extraction interrupted ({type(error).__name__})")
+            future.set_exception(error)
+        else:
+            future.set_result((value, ok))
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self.counters)
+        counters["entries"] = len(self.results)
+        return counters
+
+ocr_cache = OcrCache(OCR_CACHE_SIZE)
@@ -0,0 +1,191 @@
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dotenv import load_dotenv
+from .telemetry import OCR_CONCURRENCY_LIMIT, OCR_IN_FLIGHT, OCR_QUEUE_DEPTH
+from .vlm_client import add_call_listener, is_backend_failure
+
+load_dotenv()
+
+# Bounds of the adaptive OCR concurrency; the ceiling defaults to the former fixed VLLM_MAX_CONCURRENCY cap
+OCR_MAX_CONCURRENCY = int(os.getenv("OCR_MAX_CONCURRENCY", os.getenv("VLLM_MAX_CONCURRENCY", "16")))
+OCR_MIN_CONCURRENCY = int(os.getenv("OCR_MIN_CONCURRENCY", "1"))
+OCR_INITIAL_CONCURRENCY = int(os.getenv("OCR_INITIAL_CONCURRENCY", str(max(OCR_MIN_CONCURRENCY, OCR_MAX_CONCURRENCY // 2))))
+# Calls slower than this per crop count as congestion; unset uses OCR_LATENCY_TOLERANCE x the baseline latency
+OCR_LATENCY_TARGET = float(os.getenv("OCR_LATENCY_TARGET", "0")) or None
+OCR_LATENCY_TOLERANCE = float(os.getenv("OCR_LATENCY_TOLERANCE", "2"))
+OCR_BACKOFF = float(os.getenv("OCR_BACKOFF", "0.5"))
+
+class AIMDLimiter:
+    """
+    Additive-increase / multiplicative-decrease concurrency limit fed with every VLM call:
+    a fast success adds 1/limit (about +1 per round of calls), a backend failure or a call
+    slower than the latency threshold multiplies the limit by `backoff`, at most once per
+    threshold interval so one burst of slow calls only backs off once.
+
+    Latency is compared per crop, against a separate baseline for single-crop and multi-crop
+    calls, so enabling batching does not read as congestion.
+    """
+
+    def __init__(self, initial: int, minimum: int, maximum: int, latency_target: float = None, tolerance: float = 2.0, backoff: float = 0.5):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = float(min(maximum, max(minimum, initial)))
+        self.latency_target = latency_target
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.baselines = {}  # call kind -> slowly rising minimum of observed per-crop latencies
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+        self.counters = {"increases": 0, "decreases": 0}
+
+    def threshold(self, kind: str = "single"):
+        """Per-crop latency above which a call of `kind` counts as congestion."""
+        if self.latency_target:
+            return self.latency_target
+        baseline = self.baselines.get(kind)
+        return baseline * self.tolerance if baseline is not None else None
+
+    def record(self, seconds: float, error: Exception = None, images: int = 1):
+        images = max(1, images)
+        kind = "batch" if images > 1 else "single"
+        per_crop = seconds / images
+        with self._lock:
+            congested = error is not None and is_backend_failure(error)
+            if error is None:
+                # new lows are taken at once, the baseline only drifts up slowly
+                baseline = self.baselines.get(kind)
+                self.baselines[kind] = per_crop if baseline is None else min(per_crop, baseline + 0.01 * (per_crop - baseline))
+                threshold = self.threshold(kind)
+                congested = threshold is not None and per_crop > threshold
+            if congested:
+                now = time.monotonic()
+                if now - self._last_decrease >= (self.threshold(kind) or 0.0) * images:
+                    self.limit = max(self.minimum, self.limit * self.backoff)
+                    self._last_decrease = now
+                    self.counters["decreases"] += 1
+            elif error is None:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+                self.counters["increases"] += 1
+            OCR_CONCURRENCY_LIMIT.set(int(self.limit))
+
+    def current(self) -> int:
+        return int(self.limit)
+
+class OcrScheduler:
+    """
+    Process-wide admission control for OCR work. Jobs queue per request and are granted
+    round-robin across requests, so a chart with hundreds of labels cannot starve a small
+    one, while the number running at once follows the AIMD limit.
+
+    Blocking jobs (`submit`) run on a shared pool sized to the maximum limit; coroutines
+    (`run_async`) wait for a slot and run on the caller's event loop.
+    """
+
+    def __init__(self, limiter: AIMDLimiter):
+        self.limiter = limiter
+        self._queues = OrderedDict()  # request key -> deque of pending grants
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=limiter.maximum, thread_name_prefix="ocr")
+        self.counters = {"granted": 0, "cancelled": 0}
+
+    def _enqueue(self, key, grant):
+        with self._lock:
+            self._queues.setdefault(key, deque()).append(grant)
+            self._update_gauges()
+        self._dispatch()
+
+    def _dispatch(self):
+        granted = []
+        with self._lock:
+            while self._queues and self._in_flight < self.limiter.current():
+                key, queue = next(iter(self._queues.items()))
+                grant = queue.popleft()
+                if queue:
+                    self._queues.move_to_end(key)  # next job of this request goes behind the others
+                else:
+                    del self._queues[key]
+                if isinstance(grant, Future) and not grant.set_running_or_notify_cancel():
+                    self.counters["cancelled"] += 1
+                    continue
+                self._in_flight += 1
+                self.counters["granted"] += 1
+                granted.append(grant)
+            self._update_gauges()
+        for grant in granted:
+            if isinstance(grant, Future):
+                grant.set_result(None)
+            else:
+                self._executor.submit(grant)
+
+    def _release(self):
+        with self._lock:
+            self._in_flight -= 1
+        self._dispatch()
+
+    def _update_gauges(self):
+        OCR_QUEUE_DEPTH.set(sum(len(queue) for queue in self._queues.values()))
+        OCR_IN_FLIGHT.set(self._in_flight)
+
+    def submit(self, key, func, *args) -> Future:
+        """Queue a blocking job for request `key`; returns a Future of its result."""
+        result = Future()
+        def run():
+            if not result.set_running_or_notify_cancel():
+                self._release()
+                return
+            try:
+                result.set_result(func(*args))
+            except BaseException as e:
+                result.set_exception(e)
+            finally:
+                self._release()
+        self._enqueue(key, run)
+        return result
+
+    async def run_async(self, key, func, *args):
+        """Wait for a slot for request `key`, then await `func(*args)` on this loop."""
+        grant = Future()
+        self._enqueue(key, grant)
+        try:
+            await asyncio.wrap_future(grant)
+        except asyncio.CancelledError:
+            if not grant.cancelled():
+                self._release()  # the slot was granted while we were being cancelled
+            raise
+        try:
+            return await func(*args)
+        finally:
+            self._release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            queued = {str(key): len(queue) for key, queue in self._queues.items()}
+            counters = dict(self.counters)
+            in_flight = self._in_flight
+        return {
+            "limit": self.limiter.current(),
+            "min_limit": self.limiter.minimum,
+            "max_limit": self.limiter.maximum,
+            "in_flight": in_flight,
+            "queue_depth": sum(queued.values()),
+            "queued_requests": len(queued),
+            "baseline_latency": dict(self.limiter.baselines),
+            "latency_threshold": {kind: self.limiter.threshold(kind) for kind in list(self.limiter.baselines)},
+            **self.limiter.counters,
+            **counters,
+        }
+
+ocr_scheduler = OcrScheduler(AIMDLimiter(
+    initial=OCR_INITIAL_CONCURRENCY,
+    minimum=OCR_MIN_CONCURRENCY,
+    maximum=OCR_MAX_CONCURRENCY,
+    latency_target=OCR_LATENCY_TARGET,
+    tolerance=OCR_LATENCY_TOLERANCE,
+    backoff=OCR_BACKOFF,
+))
+add_call_listener(ocr_scheduler.limiter.record)
@@ -1,16 +1,32 @@
 import os
 import cv2
-from collections import Counter
-from .labels_conversion import detections_to_predictions
+import hashlib
+import threading
+import contextvars
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from .detection_table import DetectionTable
+from .batch_scheduler import BatchScheduler
+from .preprocessing import PreparedImage, letterbox
+from .inference_backend import BACKENDS, INFERENCE_BACKEND, INFERENCE_THREADS, RuntimeModel, load_runtime_model
 from dotenv import load_dotenv
-from .logging_config import app_logger
-from ultralytics import YOLO
+from .logging_config import app_logger, HOT_PATH
+from .telemetry import span
+from .artifact_writer import artifact_writer
 import supervision as sv
 from supervision import Detections
 import numpy as np
 
 load_dotenv()
 
+def to_bgr(image: np.ndarray) -> np.ndarray:
+    '''
+    Expand a single-channel buffer to the 3-channel BGR layout the YOLO models expect.
+    '''
+    if image.ndim == 2:
+        return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    return image
+
 class PedigreeDetector:
     def __init__(self):
         load_dotenv()
@@ -51,55 +67,318 @@ class PedigreeDetector:
             # Fetch save results flag
             self.save_results = os.getenv("SAVE_RESULTS", "False").lower() == "true"
 
+            # Parallel mode: letterbox once, run both detectors (and their NMM) concurrently
+            self.parallel = os.getenv("DETECTION_PARALLEL", "False").lower() == "true"
+            self.imgsz = int(os.getenv("DETECTION_IMGSZ", "640"))
+            # Split the cores between the two models when they run side by side
+            threads_per_model = int(os.getenv("DETECTION_THREADS_PER_MODEL", max(1, (os.cpu_count() or 2) // 2) if self.parallel else 0))
+
             # Initialize models
-            self.nodes_model = YOLO(required_models["NODES_MODEL_PATH"])
-            self.text_model = YOLO(required_models["TEXT_MODEL_PATH"])
+            self.backend = INFERENCE_BACKEND
+            if self.backend not in BACKENDS:
+                raise ValueError(f"Invalid INFERENCE_BACKEND: {self.backend}. Must be one of {BACKENDS}.")
+            if self.backend == "torch":
+                # torch and ultralytics are only imported once a detector is actually built
+                import torch
+                from ultralytics import YOLO
+                self.nodes_model = YOLO(required_models["NODES_MODEL_PATH"])
+                self.text_model = YOLO(required_models["TEXT_MODEL_PATH"])
+                if threads_per_model:
+                    # torch's intra-op pool is process wide, so this is a shared budget
+                    torch.set_num_threads(threads_per_model)
+            else:
+                # exported once and cached; each runtime session gets its own thread budget
+                threads = INFERENCE_THREADS or threads_per_model
+                self.nodes_model = load_runtime_model(required_models["NODES_MODEL_PATH"], self.backend, imgsz=self.imgsz, threads=threads)
+                self.text_model = load_runtime_model(required_models["TEXT_MODEL_PATH"], self.backend, imgsz=self.imgsz, threads=threads)
+            self.models = {"nodes": self.nodes_model, "text": self.text_model}
+            self.confs = {"nodes": self.nodes_model_conf, "text": self.text_model_conf}
+            # Non-max merge settings applied to each model's raw detections
+            self.nmm = {
+                "nodes": {"threshold": 0.1, "class_agnostic": True},  # handling overlapping nodes
+                "text": {"threshold": 0.01},
+            }
+            # YOLO predictors keep per-call state, so each model is only driven by one thread at a time
+            self.model_locks = {"nodes": threading.Lock(), "text": threading.Lock()}
+
+            # Cross-request micro-batching: concurrent detect() calls are grouped into one forward pass
+            self.batching = os.getenv("DETECTION_BATCHING", "False").lower() == "true"
+            self.batchers = {}
+            if self.batching:
+                max_batch_size = int(os.getenv("DETECTION_MAX_BATCH_SIZE", "8"))
+                max_wait_ms = float(os.getenv("DETECTION_MAX_WAIT_MS", "15"))
+                self.batchers = {
+                    name: BatchScheduler(
+                        lambda images, name=name: self.predict_batch(name, images),
+                        max_batch_size=max_batch_size,
+                        max_wait_ms=max_wait_ms,
+                        name=name,
+                    )
+                    for name in self.models
+                }
+
+            # Tiled mode for large scans: overlapping tiles at native resolution instead of one downsampled pass
+            self.tiling_min_pixels = int(os.getenv("DETECTION_TILING_MIN_PIXELS", "0"))  # 0 disables tiling
+            self.tile_size = int(os.getenv("DETECTION_TILE_SIZE", str(self.imgsz)))
+            self.tile_overlap = float(os.getenv("DETECTION_TILE_OVERLAP", "0.2"))
+            self.tile_batch_size = int(os.getenv("DETECTION_TILE_BATCH_SIZE", "4"))
+            # a seam-cut box is dropped when an uncut box from another tile covers this much of it
+            self.tile_containment = float(os.getenv("DETECTION_TILE_CONTAINMENT", "0.9"))
+            if not (0.0 <= self.tile_overlap < 1.0):
+                raise ValueError(f"Invalid DETECTION_TILE_OVERLAP: {self.tile_overlap}. Must be in [0.0, 1.0).")
+
+            self.parallel_executor = None
+            if self.parallel:
+                self.parallel_executor = ThreadPoolExecutor(
+                    max_workers=int(os.getenv("DETECTION_PARALLEL_WORKERS", "2")),
+                    thread_name_prefix="detect-parallel",
+                )
 
             app_logger.info("All models initialized successfully.")
         except Exception as e:
             app_logger.error(f"Error initializing PedigreeDetector: {str(e)}")
             raise
 
+
+    def predict_prepared(self, name: str, prepared: list) -> list:
+        '''
+        Run the `name` model on letterboxed blobs and map the boxes back to image coordinates.
+        Blobs of equal shape are concatenated into a single forward pass.
+        '''
+        groups = defaultdict(list)
+        for i, item in enumerate(prepared):
+            groups[item.blob.shape].append(i)
+        detections = [None] * len(prepared)
+        for indices in groups.values():
+            batch = np.concatenate([prepared[i].blob for i in indices])
+            model = self.models[name]
+            if isinstance(model, RuntimeModel):
+                raw = model.predict(batch, conf=self.confs[name])
+            else:
+                import torch
+                results = model(torch.from_numpy(batch), conf=self.confs[name], verbose=False)
+                raw = [sv.Detections.from_ultralytics(result) for result in results]
+            for i, result in zip(indices, raw):
+                detections[i] = prepared[i].restore(result)
+        return detections
+
+    def prepare(self, image: np.ndarray) -> PreparedImage:
+        '''
+        Letterbox a BGR image; square when batching so blobs stack across requests.
+        '''
+        return letterbox(image, self.imgsz, auto=not self.batching)
+
+    def predict_batch(self, name: str, images: list) -> list:
+        '''
+        Run one forward pass of the `name` model over a list of BGR images or PreparedImages.
+        '''
+        with self.model_locks[name]:
+            if self.backend != "torch" or all(isinstance(image, PreparedImage) for image in images):
+                prepared = [image if isinstance(image, PreparedImage) else self.prepare(image) for image in images]
+                return self.predict_prepared(name, prepared)
+            results = self.models[name](images, conf=self.confs[name], verbose=False)
+            return [sv.Detections.from_ultralytics(result) for result in results]
+
+    def batching_stats(self) -> dict:
+        '''
+        Queue depth and batch-size statistics per model, empty when batching is disabled.
+        '''
+        return {name: batcher.stats() for name, batcher in self.batchers.items()}
+
+    def save_plot(self, image: np.ndarray, detections: Detections, name: str, image_path: str):
+        '''
+        Queue a plot of the detections over the original image to `<image_path stem>/<name>.png`.
+        Drawing and encoding happen on the artifact writer thread, not during inference.
+        '''
+        dir_path = os.path.dirname(image_path)
+        file_name_without_extension = os.path.splitext(os.path.basename(image_path))[0]
+        save_dir = os.path.join(dir_path, file_name_without_extension)
+
+        def render():
+            scene = to_bgr(image)
+            annotated = sv.BoxAnnotator().annotate(scene=scene.copy() if scene is image else scene, detections=detections)
+            ok, buffer = cv2.imencode(".png", annotated)
+            if not ok:
+                raise ValueError(f"Could not encode the {name} plot")
+            return buffer.tobytes()
+
+        artifact_writer.submit(os.path.join(save_dir, f"{name}.png"), render)
+
     
     def detect(
         self,
-        image_path: str,
+        image,
         model,
         conf: float,
-        name: str = 'results'
+        name: str = 'results',
+        image_path: str = None
     ) -> Detections:
         '''
         Generic function to detect labels using a model, apply confidence, and save predictions if required.
+        The image is an already decoded BGR array or a shared PreparedImage; image_path only
+        locates the debug plots. With DETECTION_BATCHING enabled the call is routed by `name`
+        to that model's batcher.
         '''
 
-        result = model(image_path, conf=conf, verbose=False)[0]
-        detections = sv.Detections.from_ultralytics(result)
-        app_logger.info({"Detection results": dict(Counter(detections.data['class_name'])),"model":f"{name}"})
-        if self.save_results:
-            dir_path = os.path.dirname(image_path)
-            file_name_without_extension = os.path.splitext(os.path.basename(image_path))[0]
-            save_dir = os.path.join(dir_path, file_name_without_extension)
-            os.makedirs(save_dir,exist_ok=True)
-            result.plot(save=True,filename=f"{save_dir}/{name}.png",labels=False)
+        with span(f"{name}_model"):
+            if name in self.batchers:
+                detections = self.batchers[name](image)
+            elif isinstance(image, PreparedImage) or self.backend != "torch":
+                prepared = image if isinstance(image, PreparedImage) else self.prepare(image)
+                with self.model_locks[name]:
+                    detections = self.predict_prepared(name, [prepared])[0]
+            else:
+                with self.model_locks.get(name, threading.Lock()):
+                    result = model(image, conf=conf, verbose=False)[0]
+                detections = sv.Detections.from_ultralytics(result)
+        app_logger.info({"Detection results": dict(Counter(detections.data.get('class_name', []))),"model":f"{name}"}, extra=HOT_PATH)
+        if self.save_results and image_path:
+            original = image.image if isinstance(image, PreparedImage) else image
+            self.save_plot(original, detections, name, image_path)
         return detections
+
+    def detect_and_merge(self, image, name: str, image_path: str = None) -> Detections:
+        '''
+        Detect with the `name` model and apply its non-max merge.
+        '''
+        detections = self.detect(image, model=self.models[name], conf=self.confs[name], name=name, image_path=image_path)
+        with span(f"{name}_nmm"):
+            return detections.with_nmm(**self.nmm[name])
     
 
-    def detection_pipeline(self, image_path: str):
-        app_logger.info(f"Performing detection on {image_path}")
-        img = cv2.imread(image_path)
-        
-        nodes_detections = self.detect(image_path, model=self.nodes_model, conf=self.nodes_model_conf,name ="nodes")
-        text_detections = self.detect(image_path, model=self.text_model, conf=self.text_model_conf, name='text')
+    def should_tile(self, image: np.ndarray) -> bool:
+        return bool(self.tiling_min_pixels) and image.shape[0] * image.shape[1] > self.tiling_min_pixels
 
-        
-        # filtering detections
-        nodes_detections= nodes_detections.with_nmm(threshold=0.1, class_agnostic=True) # handling overlapping nodes
-        text_detections=text_detections.with_nmm(threshold=0.01)
+    def tile_offsets(self, height: int, width: int) -> list:
+        '''
+        Top-left corners of overlapping tiles covering the image; the last row and column
+        are aligned to the image edge so every tile (of an image at least that large) is full size.
+        '''
+        stride = max(1, int(self.tile_size * (1 - self.tile_overlap)))
+        def starts(length):
+            if length <= self.tile_size:
+                return [0]
+            positions = list(range(0, length - self.tile_size, stride))
+            return positions + [length - self.tile_size]
+        return [(x, y) for y in starts(height) for x in starts(width)]
+
+    def detect_tiled(self, image: np.ndarray, name: str) -> Detections:
+        '''
+        Run the `name` model over overlapping tiles, DETECTION_TILE_BATCH_SIZE tiles per forward
+        pass, and shift the boxes back to image coordinates. Tiles are views converted to BGR
+        one batch at a time, so peak memory does not grow with the scan size.
+
+        Boxes touching a tile edge that lies inside the image are cut by the seam. A cut box is
+        only dropped when an uncut box of the same class from another tile contains it; objects
+        larger than the overlap are cut in every tile, so their pieces are kept and fused by the
+        model's `with_nmm` merge, which also merges the duplicates from the overlap.
+        '''
+        height, width = image.shape[:2]
+        offsets = self.tile_offsets(height, width)
+        margin = 2
+        whole, cut_pieces = [], []
+        for start in range(0, len(offsets), self.tile_batch_size):
+            batch = offsets[start:start + self.tile_batch_size]
+            tiles = [to_bgr(image[y:y + self.tile_size, x:x + self.tile_size]) for x, y in batch]
+            for (x, y), tile, detections in zip(batch, tiles, self.predict_batch(name, tiles)):
+                if len(detections) == 0:
+                    continue
+                tile_h, tile_w = tile.shape[:2]
+                x1, y1, x2, y2 = detections.xyxy.T
+                cut = (
+                    ((x1 <= margin) & (x > 0))
+                    | ((y1 <= margin) & (y > 0))
+                    | ((x2 >= tile_w - margin) & (x + tile_w < width))
+                    | ((y2 >= tile_h - margin) & (y + tile_h < height))
+                )
+                detections.xyxy = detections.xyxy + np.array([x, y, x, y], dtype=detections.xyxy.dtype)
+                whole.append(detections[~cut])
+                cut_pieces.append(detections[cut])
+        whole = Detections.merge(whole) if whole else Detections.empty()
+        cut_pieces = Detections.merge(cut_pieces) if cut_pieces else Detections.empty()
+        if len(cut_pieces) and len(whole):
+            cut_pieces = cut_pieces[~self.covered_by(cut_pieces, whole)]
+        return Detections.merge([whole, cut_pieces])
+
+    def covered_by(self, pieces: Detections, whole: Detections) -> np.ndarray:
+        '''
+        For each seam-cut piece, whether an uncut box of the same class holds at least
+        DETECTION_TILE_CONTAINMENT of its area (the complete copy from a neighbouring tile).
+        '''
+        a, b = pieces.xyxy.astype(np.float64), whole.xyxy.astype(np.float64)
+        inter_w = np.clip(np.minimum(a[:, None, 2], b[None, :, 2]) - np.maximum(a[:, None, 0], b[None, :, 0]), 0, None)
+        inter_h = np.clip(np.minimum(a[:, None, 3], b[None, :, 3]) - np.maximum(a[:, None, 1], b[None, :, 1]), 0, None)
+        area = np.maximum((a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1]), 1e-9)
+        containment = inter_w * inter_h / area[:, None]
+        if pieces.class_id is not None and whole.class_id is not None:
+            containment = np.where(pieces.class_id[:, None] == whole.class_id[None, :], containment, 0.0)
+        return containment.max(axis=1) >= self.tile_containment
+
+    def detect_tiled_and_merge(self, image: np.ndarray, name: str, image_path: str = None) -> Detections:
+        '''
+        Tiled counterpart of `detect_and_merge`; the NMM also fuses boxes seen by two tiles.
+        '''
+        with span(f"{name}_model"):
+            detections = self.detect_tiled(image, name)
+        app_logger.info({"Detection results": dict(Counter(detections.data.get('class_name', []))),"model":f"{name}","tiles":len(self.tile_offsets(*image.shape[:2]))}, extra=HOT_PATH)
+        if self.save_results and image_path:
+            self.save_plot(image, detections, name, image_path)
+        with span(f"{name}_nmm"):
+            return detections.with_nmm(**self.nmm[name])
+
+    def detection_pipeline(self, image, image_path: str = None):
+        '''
+        Run node and text detection on an image.
+
+        Args:
+            image (np.ndarray | str): Decoded grayscale/BGR array, or a path to read it from.
+            image_path (str, optional): Location of the persisted image; debug plots go to a
+                directory named after it, or after the pixel hash when it is not given.
+        '''
+        if isinstance(image, str):
+            image_path = image_path or image
+            image = cv2.imread(image)
+        app_logger.info(f"Performing detection on {image_path or 'in-memory image'}", extra=HOT_PATH)
+        if self.save_results and not image_path:
+            # the upload was not persisted: plots still get their own content-hash directory
+            digest = hashlib.sha256(np.ascontiguousarray(image).data).hexdigest()[:32]
+            image_path = artifact_writer.path_for(f"{digest}.png")
+
+        if self.should_tile(image):
+            # Large scan: tiles are converted to BGR one batch at a time, never the whole image
+            img, inputs, detect_and_merge = image, image, self.detect_tiled_and_merge
+        else:
+            img = to_bgr(image)
+            # One letterbox for both models; square blobs when batching so they stack across requests
+            inputs = self.prepare(img) if self.parallel else img
+            detect_and_merge = self.detect_and_merge
+
+        if self.parallel:
+            text_future = self.parallel_executor.submit(
+                contextvars.copy_context().run, detect_and_merge, inputs, "text", image_path
+            )
+            nodes_detections = detect_and_merge(inputs, "nodes", image_path)
+            text_detections = text_future.result()
+        else:
+            nodes_detections = detect_and_merge(inputs, "nodes", image_path)
+            text_detections = detect_and_merge(inputs, "text", image_path)
 
         detections_list = [nodes_detections,text_detections,]
-        json_data = tuple(map(lambda detections: detections_to_predictions(detections, img), detections_list))
+        with span("detection_table"):
+            json_data = tuple(DetectionTable.from_detections(detections, img) for detections in detections_list)
 
         return json_data
 
+    def warmup(self):
+        '''
+        Run the full detection pipeline once on a synthetic chart, so lazy initialisation and
+        kernel selection happen before the first real request.
+        '''
+        image = np.full((self.imgsz, self.imgsz), 255, dtype=np.uint8)
+        cv2.rectangle(image, (self.imgsz // 4, self.imgsz // 4), (self.imgsz // 4 + 60, self.imgsz // 4 + 60), 0, 2)
+        cv2.circle(image, (3 * self.imgsz // 4, self.imgsz // 4 + 30), 30, 0, 2)
+        cv2.putText(image, "John 1950", (self.imgsz // 4, self.imgsz // 2), cv2.FONT_HERSHEY_SIMPLEX, 0.6, 0, 1)
+        self.detection_pipeline(image)
+
 if __name__ == "__main__":
     pass
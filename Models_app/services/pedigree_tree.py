@@ -1,8 +1,13 @@
 from dataclasses import dataclass, field
+from typing import Optional
+import numpy as np
 
 @dataclass
 class PedigreeTree:
-    nodes: dict = field(default_factory=dict)
-    text: dict = field(default_factory=dict)
+    nodes: dict = field(default_factory=dict)  # DetectionTable once detection has run
+    text: dict = field(default_factory=dict)   # DetectionTable once detection has run
     image_path: str = ""
     image_id : int = 0
+    image: Optional[np.ndarray] = None  # decoded grayscale pixel buffer shared by every stage
+    failed_nodes: list = field(default_factory=list)  # nodes whose OCR call failed
+    vlm_payload_bytes: list = field(default_factory=list)  # image bytes sent per VLM request
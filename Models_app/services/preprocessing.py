@@ -0,0 +1,59 @@
+from dataclasses import dataclass
+import cv2
+import numpy as np
+import supervision as sv
+
+@dataclass
+class PreparedImage:
+    """
+    An image letterboxed once into a model-ready NCHW blob, shareable by every detector.
+    """
+    image: np.ndarray  # original BGR image
+    blob: np.ndarray   # (1, 3, H, W) float32 RGB in [0, 1]
+    ratio: float
+    pad: tuple         # (left, top) padding in blob pixels
+
+    def restore(self, detections: sv.Detections) -> sv.Detections:
+        """
+        Map detections from blob coordinates back onto the original image, in place.
+        """
+        if len(detections):
+            left, top = self.pad
+            xyxy = (detections.xyxy - np.array([left, top, left, top], dtype=np.float32)) / self.ratio
+            h, w = self.image.shape[:2]
+            xyxy[:, [0, 2]] = xyxy[:, [0, 2]].clip(0, w)
+            xyxy[:, [1, 3]] = xyxy[:, [1, 3]].clip(0, h)
+            detections.xyxy = xyxy
+        return detections
+
+def letterbox(image: np.ndarray, imgsz: int = 640, stride: int = 32, auto: bool = True) -> PreparedImage:
+    """
+    Resize and pad a BGR image the same way the YOLO predictor does.
+
+    Args:
+        image (np.ndarray): BGR image.
+        imgsz (int): Target size of the longest side.
+        stride (int): Model stride the padded size must be a multiple of.
+        auto (bool): Pad only up to the next stride multiple (minimal rectangle) instead of
+            a full `imgsz` square. Square blobs can be concatenated across images for batching.
+
+    Returns:
+        PreparedImage: The blob plus what is needed to map boxes back.
+    """
+    h, w = image.shape[:2]
+    r = min(imgsz / h, imgsz / w)
+    new_w, new_h = int(round(w * r)), int(round(h * r))
+    dw, dh = imgsz - new_w, imgsz - new_h
+    if auto:
+        dw, dh = dw % stride, dh % stride
+    dw, dh = dw / 2, dh / 2
+
+    resized = image if (w, h) == (new_w, new_h) else cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
+    left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
+    padded = cv2.copyMakeBorder(resized, top, bottom, left, right, cv2.BORDER_CONSTANT, value=(114, 114, 114))
+
+    # BGR -> RGB, HWC -> CHW, add the batch axis and scale to [0, 1]
+    blob = np.ascontiguousarray(padded[..., ::-1].transpose(2, 0, 1)[None], dtype=np.float32)
+    blob /= 255.0
+    return PreparedImage(image=image, blob=blob, ratio=r, pad=(left, top))
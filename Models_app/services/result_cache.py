@@ -0,0 +1,188 @@
+import copy
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from dotenv import load_dotenv
+from .logging_config import app_logger
+
+load_dotenv()
+
+# Settings that change what process_image returns for the same bytes
+CACHE_CONFIG_KEYS = [
+    "NODES_MODEL_PATH",
+    "TEXT_MODEL_PATH",
+    "NODES_MODEL_CONF",
+    "TEXT_MODEL_CONF",
+    "INFERENCE_BACKEND",
+    "INFERENCE_INT8",
+    "DETECTION_IMGSZ",
+    "DETECTION_PARALLEL",
+    "DETECTION_BATCHING",
+    "DETECTION_TILING_MIN_PIXELS",
+    "DETECTION_TILE_SIZE",
+    "DETECTION_TILE_OVERLAP",
+    "DETECTION_TILE_CONTAINMENT",
+    "VLLM_SERVER_URL",
+    "VLLM_MODEL_ID",
+    "TEXT_ASSIGNMENT_MODE",
+    "TEXT_ASSIGNMENT_MIN_OVERLAP",
+    "TEXT_ASSIGNMENT_MAX_DISTANCE",
+    "OCR_CACHE_HASH",
+    "VLM_OUTPUT_MODE",
+    "VLM_BATCH_SIZE",
+    "VLM_MAX_TOKENS",
+    "VLM_IMAGE_FORMAT",
+    "VLM_IMAGE_QUALITY",
+    "VLM_IMAGE_GRAYSCALE",
+    "VLM_IMAGE_MAX_PIXELS",
+    "VLM_IMAGE_PATCH_SIZE",
+]
+MODEL_PATH_KEYS = ["NODES_MODEL_PATH", "TEXT_MODEL_PATH"]
+
+class LRUCache:
+    """Thread-safe in-memory LRU map bounded by entry count."""
+
+    def __init__(self, max_entries: int = 128):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+class ResultCache:
+    """
+    Content-addressed cache of `process_image` results.
+
+    Keys are a SHA-256 of the uploaded bytes plus a fingerprint of the relevant config,
+    so a model or threshold change never serves stale results. Lookups go to an
+    in-memory LRU first and then to an optional on-disk tier that evicts the least
+    recently used files once it grows past `disk_max_bytes`.
+    """
+
+    def __init__(self, max_entries: int = 128, disk_dir: str = None, disk_max_bytes: int = 512_000_000):
+        self.memory = LRUCache(max_entries)
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self.disk_max_bytes = disk_max_bytes
+        if self.disk_dir:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.memory.max_entries > 0 or self.disk_dir is not None
+
+    def config_fingerprint(self) -> str:
+        config = {key: os.getenv(key) for key in CACHE_CONFIG_KEYS}
+        # retrained weights are often dropped in at the same path
+        for key in MODEL_PATH_KEYS:
+            path = os.getenv(key)
+            config[f"{key}_mtime"] = os.path.getmtime(path) if path and os.path.exists(path) else None
+        return json.dumps(config, sort_keys=True)
+
+    def make_key(self, data: bytes, **options) -> str:
+        """
+        Build the cache key for raw image bytes and any request options that affect the result.
+        """
+        digest = hashlib.sha256(data)
+        digest.update(self.config_fingerprint().encode())
+        digest.update(json.dumps(options, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def _count(self, counter: str):
+        with self._lock:
+            self.counters[counter] += 1
+
+    def _disk_path(self, key: str) -> Path:
+        return self.disk_dir / f"{key}.json"
+
+    def get(self, key: str):
+        """Return a copy of the cached result, or None on a miss."""
+        if not key or not self.enabled:
+            return None
+        value = self.memory.get(key)
+        if value is not None:
+            self._count("memory_hits")
+            return copy.deepcopy(value)
+        if self.disk_dir:
+            path = self._disk_path(key)
+            try:
+                value = json.loads(path.read_text())
+                os.utime(path)  # mtime doubles as the LRU clock of the disk tier
+            except (OSError, ValueError):
+                value = None
+            if value is not None:
+                self._count("disk_hits")
+                self.memory.put(key, value)
+                return copy.deepcopy(value)
+        self._count("misses")
+        return None
+
+    def put(self, key: str, value):
+        if not key or not self.enabled:
+            return
+        value = copy.deepcopy(value)
+        self.memory.put(key, value)
+        self._count("stores")
+        if self.disk_dir:
+            try:
+                path = self._disk_path(key)
+                tmp_path = path.with_suffix(f".{threading.get_ident()}.tmp")
+                tmp_path.write_text(json.dumps(value))
+                os.replace(tmp_path, path)
+                self._evict_disk()
+            except OSError as e:
+                app_logger.warning(f"Could not write result cache entry {key}: {e}")
+
+    def _evict_disk(self):
+        entries = []
+        for path in self.disk_dir.glob("*.json"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries, key=lambda entry: entry[0]):
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                path.unlink()
+                total -= size
+                self._count("evictions")
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self.counters)
+        lookups = counters["memory_hits"] + counters["disk_hits"] + counters["misses"]
+        counters["hit_rate"] = (counters["memory_hits"] + counters["disk_hits"]) / lookups if lookups else 0.0
+        counters["memory_entries"] = len(self.memory)
+        return counters
+
+result_cache = ResultCache(
+    max_entries=int(os.getenv("RESULT_CACHE_SIZE", "128")),
+    disk_dir=os.getenv("RESULT_CACHE_DIR") or None,
+    disk_max_bytes=int(os.getenv("RESULT_CACHE_MAX_BYTES", "512000000")),
+)
@@ -0,0 +1,57 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dotenv import load_dotenv
+from .logging_config import app_logger
+
+load_dotenv()
+
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "True").lower() == "true"
+
+class StartupState:
+    """Tracks the managed startup phases and whether the worker can take traffic."""
+
+    def __init__(self):
+        self.ready = False
+        self.error = None
+        self.phases = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.phases[name] = round(elapsed, 3)
+            app_logger.info(f"Startup phase {name} took {elapsed:.2f} seconds")
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"ready": self.ready, "error": self.error, "phases": dict(self.phases)}
+
+startup_state = StartupState()
+
+def run_startup(state: StartupState = startup_state):
+    """
+    Load the models, build the VLM client and optionally warm up, timing each phase.
+    Blocking; the app runs it in a worker thread so /health answers immediately.
+    """
+    try:
+        with state.phase("load_models"):
+            from .image_processor import get_detector, warmup
+            get_detector()
+        with state.phase("init_vlm_client"):
+            from .vlm_client import get_vlm_client
+            get_vlm_client()
+        if WARMUP_ON_STARTUP:
+            with state.phase("warmup"):
+                warmup()
+        state.ready = True
+        app_logger.info(f"Worker ready: {state.snapshot()['phases']}")
+    except Exception as e:
+        state.error = f"{type(e).__name__}: {e}"
+        app_logger.error(f"Startup failed: {e}", exc_info=True)
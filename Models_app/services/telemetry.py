@@ -0,0 +1,88 @@
+import contextvars
+import functools
+import inspect
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from dotenv import load_dotenv
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+from .logging_config import image_id_var
+
+load_dotenv()
+
+# Bucket edges in seconds, from sub-millisecond NMS up to slow VLM calls
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+STAGE_SECONDS = Histogram("pedigree_stage_seconds", "Time spent in each pipeline stage", ["stage"], buckets=LATENCY_BUCKETS)
+STAGE_IN_FLIGHT = Gauge("pedigree_stage_in_flight", "Pipeline stages currently executing", ["stage"])
+HTTP_SECONDS = Histogram("pedigree_http_request_seconds", "HTTP request latency", ["method", "route", "status"], buckets=LATENCY_BUCKETS)
+HTTP_IN_FLIGHT = Gauge("pedigree_http_requests_in_flight", "HTTP requests currently being served")
+OCR_QUEUE_DEPTH = Gauge("pedigree_ocr_queue_depth", "OCR jobs waiting for a VLM concurrency slot")
+OCR_IN_FLIGHT = Gauge("pedigree_ocr_in_flight", "OCR jobs holding a VLM concurrency slot")
+OCR_CONCURRENCY_LIMIT = Gauge("pedigree_ocr_concurrency_limit", "Current adaptive (AIMD) OCR concurrency limit")
+ARTIFACTS = Counter("pedigree_artifacts_total", "Debug artifacts by outcome (written, dropped, failed, evicted)", ["outcome"])
+VLM_CALLS = Counter("pedigree_vlm_calls_total", "VLM client calls by outcome (success, error, timeout, circuit_open, hedged, ...)", ["outcome"])
+
+# Spans of the current request; a list shared by every context copied from the request's
+# (executor threads, asyncio tasks), so stages running elsewhere still land in the trace.
+_trace_var = contextvars.ContextVar("trace", default=None)
+
+def start_trace() -> list:
+    """Begin collecting spans for the current request and return the (live) span list."""
+    trace = []
+    _trace_var.set(trace)
+    return trace
+
+@contextmanager
+def span(stage: str):
+    """
+    Time a pipeline stage: always observed in the stage histogram, and appended to the
+    current request's trace (tagged with `image_id_var`) when one was started.
+    """
+    gauge = STAGE_IN_FLIGHT.labels(stage)
+    gauge.inc()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        gauge.dec()
+        STAGE_SECONDS.labels(stage).observe(elapsed)
+        trace = _trace_var.get()
+        if trace is not None:
+            trace.append({"stage": stage, "image_id": image_id_var.get(), "start": started, "seconds": elapsed})
+
+def traced(stage: str):
+    """Decorator form of `span` for plain and async functions."""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(stage):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def timing_breakdown(trace: list) -> dict:
+    """
+    Collapse a trace into {stage: {"count", "total_ms", "max_ms"}}. Stages that run
+    concurrently (the two detectors, VLM calls) overlap, so totals can exceed wall time.
+    """
+    stages = defaultdict(lambda: {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+    for record in trace:
+        stage = stages[record["stage"]]
+        ms = record["seconds"] * 1000
+        stage["count"] += 1
+        stage["total_ms"] += ms
+        stage["max_ms"] = max(stage["max_ms"], ms)
+    return {name: {key: round(value, 3) for key, value in stats.items()} for name, stats in stages.items()}
+
+def metrics_payload():
+    """Prometheus text exposition of every registered metric, with its content type."""
+    return generate_latest(), CONTENT_TYPE_LATEST
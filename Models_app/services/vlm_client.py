@@ -0,0 +1,355 @@
+import asyncio
+import os
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import httpx
+import numpy as np
+from dotenv import load_dotenv
+from .logging_config import app_logger
+from .telemetry import VLM_CALLS, span
+
+load_dotenv()
+
+VLLM_SERVER_URL = os.getenv("VLLM_SERVER_URL")
+VLLM_MODEL_ID = os.getenv("VLLM_MODEL_ID")
+# HTTP connection pool shared by every VLM call of the process
+VLM_MAX_CONNECTIONS = int(os.getenv("VLM_MAX_CONNECTIONS", "32"))
+VLM_MAX_KEEPALIVE = int(os.getenv("VLM_MAX_KEEPALIVE", "16"))
+# Adaptive timeout: VLM_TIMEOUT until enough samples, then p99 * multiplier clamped to [min, max];
+# every timeout doubles it (up to the max) so a backend that slowed down is not timed out forever
+VLM_TIMEOUT = float(os.getenv("VLM_TIMEOUT", "2"))
+VLM_TIMEOUT_MIN = float(os.getenv("VLM_TIMEOUT_MIN", str(VLM_TIMEOUT)))
+VLM_TIMEOUT_MAX = float(os.getenv("VLM_TIMEOUT_MAX", "10"))
+VLM_TIMEOUT_MULTIPLIER = float(os.getenv("VLM_TIMEOUT_MULTIPLIER", "2"))
+VLM_MAX_RETRIES = int(os.getenv("VLM_MAX_RETRIES", "1"))
+# Hedging: send a duplicate request when the first is slower than the given latency percentile
+VLM_HEDGE = os.getenv("VLM_HEDGE", "False").lower() == "true"
+VLM_HEDGE_PERCENTILE = float(os.getenv("VLM_HEDGE_PERCENTILE", "95"))
+# Circuit breaker: open after N consecutive failures, probe again after the reset period
+VLM_BREAKER_FAILURES = int(os.getenv("VLM_BREAKER_FAILURES", "5"))
+VLM_BREAKER_RESET_SECONDS = float(os.getenv("VLM_BREAKER_RESET_SECONDS", "10"))
+
+MIN_LATENCY_SAMPLES = 20
+
+# Callables receiving (seconds, error, images) for every backend call, e.g. the OCR concurrency limiter
+_call_listeners = []
+
+def add_call_listener(listener):
+    _call_listeners.append(listener)
+
+def count_images(messages) -> int:
+    """Number of image parts in a chat request, i.e. crops read by one call."""
+    return sum(
+        1
+        for message in messages
+        if isinstance(message.get("content"), list)
+        for part in message["content"]
+        if part.get("type") == "image_url"
+    )
+
+class CircuitOpenError(Exception):
+    """Raised without calling the backend while the circuit breaker is open."""
+
+class LatencyTracker:
+    """Sliding window of recent successful call latencies."""
+
+    def __init__(self, window: int = 500):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, q: float):
+        with self._lock:
+            if len(self._samples) < MIN_LATENCY_SAMPLES:
+                return None
+            samples = np.fromiter(self._samples, dtype=np.float64)
+        return float(np.percentile(samples, q))
+
+class AdaptiveTimeout:
+    """
+    Timeout derived from the observed latency tail instead of a fixed value. Only successes
+    are latency samples, so timeouts feed back separately: each one doubles a backoff factor
+    and each success shrinks it back towards 1.
+    """
+
+    def __init__(self, latencies: LatencyTracker, initial: float, minimum: float, maximum: float, multiplier: float):
+        self.latencies = latencies
+        self.initial = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.multiplier = multiplier
+        self.backoff = 1.0
+        self._lock = threading.Lock()
+
+    def base(self) -> float:
+        p99 = self.latencies.percentile(99)
+        return self.initial if p99 is None else p99 * self.multiplier
+
+    def current(self) -> float:
+        return min(self.maximum, max(self.minimum, self.base() * self.backoff))
+
+    def record_timeout(self):
+        with self._lock:
+            # no point growing past the point where the timeout is pinned at the maximum
+            self.backoff = min(self.backoff * 2, max(1.0, self.maximum / max(self.base(), 1e-9)))
+
+    def record_success(self):
+        with self._lock:
+            self.backoff = max(1.0, self.backoff * 0.9)
+
+class CircuitBreaker:
+    """
+    Closed -> open after `failure_threshold` consecutive failures; after `reset_timeout`
+    seconds a single probe call is let through (half-open) and its outcome closes or
+    re-opens the circuit.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 10):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self._probing = False
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self._failures = 0
+            self._probing = False
+
+    def release_probe(self):
+        """A probe that never got an answer (cancelled): let the next call probe instead."""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == "half_open" or self._failures >= self.failure_threshold:
+                if self.state != "open":
+                    app_logger.warning(f"VLM circuit breaker opened after {self._failures} consecutive failures")
+                self.state = "open"
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+def is_backend_failure(error: Exception) -> bool:
+    """Timeouts, connection errors and 5xx count against the breaker; client errors do not."""
+    from openai import APIConnectionError, APIStatusError, APITimeoutError
+    if isinstance(error, (APITimeoutError, APIConnectionError)):
+        return True
+    return isinstance(error, APIStatusError) and error.status_code >= 500
+
+class VLMClient:
+    """
+    OpenAI-compatible chat client for the vLLM server with a sized connection pool,
+    adaptive timeouts, bounded retries, optional hedged requests, a circuit breaker and
+    per-outcome counters. Exposes blocking `complete` and awaitable `acomplete`.
+    """
+
+    def __init__(self, base_url: str = VLLM_SERVER_URL, model: str = VLLM_MODEL_ID, api_key: str = "EMPTY"):
+        from openai import OpenAI, AsyncOpenAI
+        self.model = model
+        limits = httpx.Limits(max_connections=VLM_MAX_CONNECTIONS, max_keepalive_connections=VLM_MAX_KEEPALIVE)
+        # retries are handled here so they can respect the breaker and the adaptive timeout
+        self.client = OpenAI(api_key=api_key, base_url=base_url, max_retries=0, http_client=httpx.Client(limits=limits))
+        self.async_client = AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=0, http_client=httpx.AsyncClient(limits=limits))
+        self.latencies = LatencyTracker()
+        self.timeout = AdaptiveTimeout(self.latencies, VLM_TIMEOUT, VLM_TIMEOUT_MIN, VLM_TIMEOUT_MAX, VLM_TIMEOUT_MULTIPLIER)
+        self.breaker = CircuitBreaker(VLM_BREAKER_FAILURES, VLM_BREAKER_RESET_SECONDS)
+        self.hedge = VLM_HEDGE
+        self.max_retries = VLM_MAX_RETRIES
+        self.outcomes = Counter()
+        self._lock = threading.Lock()
+        self._hedge_executor = ThreadPoolExecutor(max_workers=VLM_MAX_CONNECTIONS, thread_name_prefix="vlm-hedge") if self.hedge else None
+
+    def count(self, outcome: str):
+        with self._lock:
+            self.outcomes[outcome] += 1
+        VLM_CALLS.labels(outcome).inc()
+
+    def hedge_delay(self):
+        return self.latencies.percentile(VLM_HEDGE_PERCENTILE) if self.hedge else None
+
+    def _request(self, messages, max_tokens, response_format=None):
+        request = dict(model=self.model, messages=messages, max_tokens=max_tokens, timeout=self.timeout.current())
+        if response_format is not None:
+            request["response_format"] = response_format  # guided decoding on vLLM
+        return request
+
+    def _record(self, started: float, error: Exception = None, images: int = 1):
+        for listener in _call_listeners:
+            listener(time.perf_counter() - started, error, images)
+        if error is None:
+            self.latencies.record(time.perf_counter() - started)
+            self.timeout.record_success()
+            self.breaker.record_success()
+            self.count("success")
+        elif is_backend_failure(error):
+            self.breaker.record_failure()
+            if type(error).__name__ == "APITimeoutError":
+                self.timeout.record_timeout()
+                self.count("timeout")
+            else:
+                self.count("error")
+        else:
+            # the backend answered (e.g. a 4xx), so it is healthy; this also resolves a half-open probe
+            self.breaker.record_success()
+            self.count("error")
+
+    def _abandon(self):
+        """The call was cancelled before an outcome: free the probe slot if it held it."""
+        self.breaker.release_probe()
+        self.count("cancelled")
+
+    def _call(self, messages, max_tokens, response_format=None) -> str:
+        if not self.breaker.allow():
+            self.count("circuit_open")
+            raise CircuitOpenError("VLM circuit breaker is open")
+        images = count_images(messages)
+        started = time.perf_counter()
+        try:
+            with span("vlm_call"):
+                response = self.client.chat.completions.create(**self._request(messages, max_tokens, response_format))
+        except Exception as e:
+            self._record(started, e, images)
+            raise
+        except BaseException:
+            self._abandon()
+            raise
+        self._record(started, images=images)
+        return response.choices[0].message.content
+
+    async def _acall(self, messages, max_tokens, response_format=None) -> str:
+        if not self.breaker.allow():
+            self.count("circuit_open")
+            raise CircuitOpenError("VLM circuit breaker is open")
+        images = count_images(messages)
+        started = time.perf_counter()
+        try:
+            with span("vlm_call"):
+                response = await self.async_client.chat.completions.create(**self._request(messages, max_tokens, response_format))
+        except Exception as e:
+            self._record(started, e, images)
+            raise
+        except BaseException:
+            self._abandon()
+            raise
+        self._record(started, images=images)
+        return response.choices[0].message.content
+
+    def _hedged_call(self, messages, max_tokens, response_format=None) -> str:
+        delay = self.hedge_delay()
+        if delay is None:
+            return self._call(messages, max_tokens, response_format)
+        primary = self._hedge_executor.submit(self._call, messages, max_tokens, response_format)
+        pending = {primary}
+        done, _ = wait(pending, timeout=delay)
+        if not done:
+            self.count("hedged")
+            pending.add(self._hedge_executor.submit(self._call, messages, max_tokens, response_format))
+        error = None
+        while pending:
+            # a straggling loser cannot be cancelled once running; it finishes in the background
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is not primary:
+                        self.count("hedge_won")
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    async def _ahedged_call(self, messages, max_tokens, response_format=None) -> str:
+        delay = self.hedge_delay()
+        if delay is None:
+            return await self._acall(messages, max_tokens, response_format)
+        primary = asyncio.ensure_future(self._acall(messages, max_tokens, response_format))
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            return primary.result()
+        self.count("hedged")
+        hedge = asyncio.ensure_future(self._acall(messages, max_tokens, response_format))
+        pending = {primary, hedge}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.count("hedge_won")
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def complete(self, messages, max_tokens: int = 64, response_format: dict = None) -> str:
+        """
+        Blocking chat completion; retries backend failures up to VLM_MAX_RETRIES times.
+        `response_format` (an OpenAI json_schema response format) constrains the output.
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self._hedged_call(messages, max_tokens, response_format) if self.hedge else self._call(messages, max_tokens, response_format)
+            except Exception as e:
+                if attempt >= self.max_retries or not is_backend_failure(e):
+                    raise
+                self.count("retry")
+                time.sleep(0.05 * 2 ** attempt)
+
+    async def acomplete(self, messages, max_tokens: int = 64, response_format: dict = None) -> str:
+        """Awaitable counterpart of `complete`."""
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await (self._ahedged_call(messages, max_tokens, response_format) if self.hedge else self._acall(messages, max_tokens, response_format))
+            except Exception as e:
+                if attempt >= self.max_retries or not is_backend_failure(e):
+                    raise
+                self.count("retry")
+                await asyncio.sleep(0.05 * 2 ** attempt)
+
+    def stats(self) -> dict:
+        with self._lock:
+            outcomes = dict(self.outcomes)
+        return {
+            "outcomes": outcomes,
+            "breaker_state": self.breaker.state,
+            "timeout_seconds": self.timeout.current(),
+            "timeout_backoff": self.timeout.backoff,
+            "latency_p50": self.latencies.percentile(50),
+            "latency_p95": self.latencies.percentile(95),
+            "latency_p99": self.latencies.percentile(99),
+        }
+
+_vlm_client = None
+_vlm_client_lock = threading.Lock()
+
+def get_vlm_client() -> VLMClient:
+    """The process-wide VLMClient, created on first use."""
+    global _vlm_client
+    if _vlm_client is None:
+        with _vlm_client_lock:
+            if _vlm_client is None:
+                _vlm_client = VLMClient()
+    return _vlm_client
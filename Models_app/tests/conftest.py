@@ -0,0 +1,5 @@
+import os
+import tempfile
+
+# Service modules open their log file on import; keep it out of the working tree
+os.environ.setdefault("LOG_FILE_PATH", os.path.join(tempfile.gettempdir(), "pedigree-tests", "app.log"))
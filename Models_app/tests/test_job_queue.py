@@ -0,0 +1,86 @@
+import asyncio
+import sqlite3
+import time
+from Models_app.services import job_queue
+from Models_app.services.job_queue import JobStore, JobWorkerPool
+
+def test_claim_records_owner_and_returns_a_bool_option(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    job_id = store.enqueue("img", "https://example.com/a.png", apply_orientation_correction=True)
+    job = store.claim_next("pool-a")
+    assert job["id"] == job_id
+    assert job["owner"] == "pool-a"
+    assert job["attempts"] == 1
+    assert job["apply_orientation_correction"] is True
+    assert store.claim_next("pool-b") is None
+
+def test_only_expired_leases_are_taken_over(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    live = store.enqueue("live", "https://example.com/a.png")
+    dead = store.enqueue("dead", "https://example.com/b.png")
+    store.claim_next("pool-a", lease=60)
+    store.claim_next("pool-b", lease=0.01)
+    time.sleep(0.05)
+    assert store.requeue_expired() == 1
+    assert store.get(live)["status"] == "running"
+    assert store.get(dead)["status"] == "queued"
+    # the pool that lost its lease can no longer finish the job
+    store.complete(dead, "pool-b", {"ok": True})
+    assert store.get(dead)["status"] == "queued"
+
+def test_stop_requeues_only_the_pools_own_jobs(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    mine = store.enqueue("mine", "https://example.com/a.png")
+    theirs = store.enqueue("theirs", "https://example.com/b.png")
+    store.claim_next("pool-a")
+    store.claim_next("pool-b")
+    assert store.requeue_owned("pool-a") == 1
+    assert store.get(mine)["status"] == "queued"
+    assert store.get(theirs)["status"] == "running"
+
+def test_retried_job_waits_for_its_backoff(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    job_id = store.enqueue("img", "https://example.com/a.png")
+    store.claim_next("pool-a")
+    store.fail(job_id, "pool-a", "fetch failed", retry_in=60)
+    assert store.get(job_id)["status"] == "queued"
+    assert store.claim_next("pool-a") is None
+
+def test_store_created_before_leases_is_migrated(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE jobs (id TEXT PRIMARY KEY, image_id TEXT NOT NULL, source_url TEXT NOT NULL, "
+        "apply_orientation_correction INTEGER NOT NULL, status TEXT NOT NULL, result TEXT, error TEXT, "
+        "attempts INTEGER NOT NULL DEFAULT 0, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+    )
+    conn.execute("INSERT INTO jobs VALUES ('old', 'img', 'https://example.com/a.png', 1, 'queued', NULL, NULL, 0, 0, 0)")
+    conn.commit()
+    conn.close()
+    store = JobStore(path)
+    assert store.claim_next("pool-a")["id"] == "old"
+
+def test_worker_survives_a_failing_claim(monkeypatch):
+    monkeypatch.setattr(job_queue, "JOB_POLL_SECONDS", 0.01)
+
+    class FlakyStore:
+        calls = 0
+
+        def claim_next(self, owner):
+            self.calls += 1
+            if self.calls == 1:
+                raise RuntimeError("database is locked")
+            return None
+
+    store = FlakyStore()
+    pool = JobWorkerPool(store, process=None, workers=1)
+
+    async def main():
+        pool._wakeup = asyncio.Event()
+        worker = asyncio.create_task(pool._worker())
+        await asyncio.sleep(0.1)
+        assert not worker.done()
+        worker.cancel()
+
+    asyncio.run(main())
+    assert store.calls > 1
@@ -0,0 +1,28 @@
+import asyncio
+import pytest
+from Models_app.services.ocr_cache import OcrCache
+
+def test_concurrent_claims_share_one_extraction():
+    cache = OcrCache()
+    _, owner_future, owner = cache.claim("k")
+    _, waiter_future, waiter_owns = cache.claim("k")
+    assert owner and not waiter_owns
+    assert waiter_future is owner_future
+    cache.release("k", {"name": "Ann"})
+    assert waiter_future.result(0) == ({"name": "Ann"}, True)
+    assert cache.claim("k") == ({"name": "Ann"}, None, False)
+
+def test_failed_extraction_is_not_memoized():
+    cache = OcrCache()
+    cache.claim("k")
+    cache.release("k", {"name": ""}, ok=False)
+    assert cache.claim("k")[2] is True
+
+def test_cancelled_owner_fails_waiters_with_a_regular_error():
+    cache = OcrCache()
+    cache.claim("k")
+    _, future, _ = cache.claim("k")
+    cache.release("k", error=asyncio.CancelledError())
+    # a CancelledError here would look like the waiter itself being cancelled
+    with pytest.raises(RuntimeError):
+        future.result(0)
@@ -0,0 +1,87 @@
+import asyncio
+import threading
+import httpx
+import pytest
+from openai import APITimeoutError
+from Models_app.services.ocr_scheduler import AIMDLimiter, OcrScheduler
+
+def make_scheduler(limit=1):
+    return OcrScheduler(AIMDLimiter(initial=limit, minimum=limit, maximum=limit))
+
+def test_cancelled_while_queued_never_takes_a_slot():
+    scheduler = make_scheduler()
+
+    async def main():
+        release = asyncio.Event()
+        holder = asyncio.create_task(scheduler.run_async("a", release.wait))
+        await asyncio.sleep(0)
+        queued = asyncio.create_task(scheduler.run_async("b", asyncio.sleep, 0))
+        await asyncio.sleep(0)
+        queued.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await queued
+        release.set()
+        await holder
+        # the slot freed by `holder` must not be lost to the cancelled grant
+        assert await asyncio.wait_for(scheduler.run_async("c", asyncio.sleep, 0, "done"), 1) == "done"
+
+    asyncio.run(main())
+    stats = scheduler.stats()
+    assert stats["in_flight"] == 0
+    assert stats["queue_depth"] == 0
+    assert stats["cancelled"] == 1
+
+def test_slot_released_when_job_raises_or_is_cancelled():
+    scheduler = make_scheduler()
+
+    async def fail():
+        raise ValueError("boom")
+
+    async def main():
+        with pytest.raises(ValueError):
+            await scheduler.run_async("a", fail)
+        running = asyncio.create_task(scheduler.run_async("a", asyncio.sleep, 60))
+        await asyncio.sleep(0.01)
+        assert scheduler.stats()["in_flight"] == 1
+        running.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await running
+
+    asyncio.run(main())
+    assert scheduler.stats()["in_flight"] == 0
+
+def test_blocking_jobs_are_granted_round_robin_across_requests():
+    scheduler = make_scheduler()
+    started = threading.Event()
+    release = threading.Event()
+    order = []
+
+    def job(name, wait=False):
+        order.append(name)
+        if wait:
+            started.set()
+            release.wait(5)
+
+    first = scheduler.submit("a", job, "a1", True)
+    assert started.wait(5)
+    futures = [scheduler.submit("a", job, "a2"), scheduler.submit("a", job, "a3"), scheduler.submit("b", job, "b1")]
+    release.set()
+    for future in [first, *futures]:
+        future.result(5)
+    assert order == ["a1", "a2", "b1", "a3"]
+    assert scheduler.stats()["in_flight"] == 0
+
+def test_limiter_backs_off_on_backend_failure():
+    limiter = AIMDLimiter(initial=8, minimum=1, maximum=16)
+    limiter.record(1.0, APITimeoutError(request=httpx.Request("POST", "http://vlm.test")))
+    assert limiter.current() == 4
+
+def test_batched_calls_do_not_read_as_congestion():
+    limiter = AIMDLimiter(initial=8, minimum=1, maximum=16)
+    limiter.record(1.0)
+    # eight crops in 4s is far slower than one single-crop call, but faster per crop
+    limiter.record(4.0, images=8)
+    limiter.record(4.5, images=8)
+    assert limiter.counters["decreases"] == 0
+    limiter.record(3.0)  # a single-crop call at 3x its baseline is congestion
+    assert limiter.counters["decreases"] == 1
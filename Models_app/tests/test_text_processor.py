@@ -0,0 +1,81 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+from types import SimpleNamespace
+import pytest
+from Models_app.processors import text_processor
+from Models_app.processors.text_processor import TextProcessor
+from Models_app.services.ocr_cache import OcrCache
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = OcrCache()
+    monkeypatch.setattr(text_processor, "ocr_cache", cache)
+    return cache
+
+def make_processor():
+    tree = SimpleNamespace(failed_nodes=[], nodes=SimpleNamespace(set_fields=lambda node_id, fields: None), vlm_payload_bytes=[])
+    return TextProcessor(tree)
+
+def test_closed_stream_still_releases_its_claims(cache):
+    processor = make_processor()
+    cache.claim("k")  # taken by this request in prepare_crops
+    _, waiter, _ = cache.claim("k")  # another request coalesces onto the same crop
+    batch_started = threading.Event()
+
+    def prepare_crops():
+        return [("k", "image", [1])], [], [7]
+
+    async def extract(batch):
+        batch_started.set()
+        await asyncio.sleep(0.01)
+        return processor.publish_crops(batch, [({"name": "Ann"}, True)])
+
+    processor.prepare_crops = prepare_crops
+    processor.extract_text_from_label_async = extract
+
+    async def main():
+        stream = processor.iter_text_data_async()
+        assert await stream.__anext__() == [7]  # cached nodes come first
+        await stream.aclose()  # the client went away
+        await asyncio.sleep(0.05)
+
+    asyncio.run(main())
+    assert batch_started.is_set()
+    assert waiter.result(0) == ({"name": "Ann"}, True)
+
+def test_cancelled_prepare_releases_the_claims_it_took(cache):
+    processor = make_processor()
+    claimed = threading.Event()
+    proceed = threading.Event()
+
+    def prepare_crops():
+        cache.claim("k")
+        claimed.set()
+        proceed.wait(5)
+        return [("k", "image", [1])], [], []
+
+    processor.prepare_crops = prepare_crops
+
+    async def main():
+        task = asyncio.create_task(processor.prepare_crops_async())
+        await asyncio.to_thread(claimed.wait, 5)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        _, waiter, owner = cache.claim("k")
+        assert not owner
+        proceed.set()
+        with pytest.raises(RuntimeError):
+            await asyncio.wait_for(asyncio.wrap_future(waiter), 5)
+
+    asyncio.run(main())
+
+def test_wait_for_a_stuck_owner_is_bounded(monkeypatch):
+    monkeypatch.setattr(text_processor, "OCR_WAIT_TIMEOUT", 0.01)
+    processor = make_processor()
+    never_done = Future()
+    assert asyncio.run(processor.wait_for_crop(never_done, [3, 4])) == [3, 4]
+    assert processor.tree.failed_nodes == [3, 4]
+    # giving up must not cancel the owner's future for the other waiters
+    assert not never_done.cancelled()
@@ -0,0 +1,70 @@
+import asyncio
+from types import SimpleNamespace
+import httpx
+import pytest
+from openai import BadRequestError
+from Models_app.services.vlm_client import AdaptiveTimeout, CircuitBreaker, LatencyTracker, VLMClient
+
+MESSAGES = [{"role": "user", "content": [{"type": "text", "text": "read"}]}]
+
+def fake_backend(create):
+    return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+def half_open_client():
+    client = VLMClient(base_url="http://vlm.test/v1", model="test")
+    client.breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    client.breaker.record_failure()
+    assert client.breaker.state == "open"
+    return client
+
+def test_half_open_breaker_lets_a_single_probe_through():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.release_probe()
+    assert breaker.allow()
+
+def test_probe_ending_in_client_error_closes_the_breaker():
+    client = half_open_client()
+
+    async def create(**_):
+        request = httpx.Request("POST", "http://vlm.test/v1/chat/completions")
+        raise BadRequestError("bad request", response=httpx.Response(400, request=request), body=None)
+
+    client.async_client = fake_backend(create)
+    with pytest.raises(BadRequestError):
+        asyncio.run(client._acall(MESSAGES, 8))
+    assert client.breaker.state == "closed"
+
+def test_cancelled_probe_frees_the_probe_slot():
+    client = half_open_client()
+
+    async def create(**_):
+        await asyncio.sleep(60)
+
+    client.async_client = fake_backend(create)
+
+    async def main():
+        probe = asyncio.create_task(client._acall(MESSAGES, 8))
+        await asyncio.sleep(0.01)
+        assert not client.breaker.allow()  # the probe is in flight
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+
+    asyncio.run(main())
+    assert client.breaker.allow()
+    assert client.stats()["outcomes"]["cancelled"] == 1
+
+def test_timeouts_raise_the_adaptive_timeout_and_successes_lower_it():
+    timeout = AdaptiveTimeout(LatencyTracker(), initial=2, minimum=2, maximum=10, multiplier=2)
+    assert timeout.current() == 2
+    timeout.record_timeout()
+    assert timeout.current() == 4
+    for _ in range(5):
+        timeout.record_timeout()
+    assert timeout.current() == 10
+    for _ in range(50):
+        timeout.record_success()
+    assert timeout.current() == 2